@@ -0,0 +1,179 @@
+"""In-process stand-ins for SlackSocket and JIRA
+
+Both sleep for a configurable latency on every call, fail a configurable fraction of calls and count what they were
+asked to do, so server.py can be driven at scale without touching either service.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from jira.exceptions import JIRAError
+from threading import Lock
+from types import SimpleNamespace
+import queue
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+STATUS_IDS = {"Open": "1", "In Progress": "3", "On Hold": "10000"}
+# transition name -> (id, status it moves the ticket to)
+TRANSITIONS = {"Halt Work": ("21", "On Hold"), "Resume Work": ("31", "In Progress")}
+
+
+class EndOfEvents(Exception):
+    """Raised by FakeSlackSocket.get_event once close() has been called and every event has been read"""
+
+
+class _Service(object):
+    def __init__(self, latency: float, error_rate: float) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()  # type: Counter
+        self._lock = Lock()
+
+    def _call(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self._fail(name)
+
+    def _fail(self, name: str) -> None:
+        raise RuntimeError("injected {0} failure".format(name))
+
+
+class FakeSlackSocket(_Service):
+    """Serves queued events and records posted messages
+
+    The latency of a message is measured from when it is queued with push_message to the first post the bot makes in
+    reply to it.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0) -> None:
+        super().__init__(latency, error_rate)
+        self.__events = queue.Queue()  # type: queue.Queue
+        self.__waiting = defaultdict(list)  # type: Dict[str, List[float]]
+        self.reply_latencies = []  # type: List[float]
+        self.posts = []  # type: List[tuple]
+
+    def push_message(self, username: str, text: str) -> None:
+        """Queue an IM from a user to the bot"""
+        with self._lock:
+            self.__waiting[self.channel_of(username)].append(time.perf_counter())
+        self.__events.put({"type": "message", "user": username, "channel": username, "text": text})
+
+    def close(self) -> None:
+        self.__events.put(None)
+
+    @staticmethod
+    def channel_of(username: str) -> str:
+        return "D" + username
+
+    def get_event(self) -> SimpleNamespace:
+        event = self.__events.get()
+        if event is None:
+            self.__events.put(None)
+            raise EndOfEvents()
+        return SimpleNamespace(event=event)
+
+    def get_im_channel(self, username: str) -> dict:
+        self._call("get_im_channel")
+        return {"id": self.channel_of(username)}
+
+    def send_msg(self, text: str, channel_id: str = None, confirm: bool = True) -> None:
+        self._call("send_msg")
+        with self._lock:
+            self.posts.append((channel_id, text))
+            if self.__waiting[channel_id]:
+                now = time.perf_counter()
+                self.reply_latencies += [now - t for t in self.__waiting.pop(channel_id)]
+
+
+class FakeResultList(list):
+    def __init__(self, issues: list, total: int) -> None:
+        super().__init__(issues)
+        self.total = total
+
+
+class FakeJIRA(_Service):
+    """Enough of the JIRA client for server.py, over an in-memory set of tickets
+
+    Only the JQL server.py generates is understood: project, assignee, key and status equality, "in" lists and
+    "updated >=", with dates in the tz time zone.
+    """
+
+    def __init__(self, tz, latency: float = 0.0, error_rate: float = 0.0) -> None:
+        super().__init__(latency, error_rate)
+        self.__tz = tz
+        self.issues = {}  # type: Dict[str, SimpleNamespace]
+
+    def _fail(self, name: str) -> None:
+        raise JIRAError(status_code=503, text="injected {0} failure".format(name))
+
+    def add_issue(self, key: str, assignee: Optional[str], status: str, summary: str = "") -> None:
+        self.issues[key] = SimpleNamespace(key=key, fields=SimpleNamespace(
+            summary=summary or "Summary of " + key,
+            status=SimpleNamespace(name=status, id=STATUS_IDS[status]),
+            assignee=SimpleNamespace(name=assignee) if assignee else None,
+            project=SimpleNamespace(key=key.split("-")[0]),
+            issuetype=SimpleNamespace(id="1")), updated=self.__now())
+
+    def set_status(self, key: str, status: str) -> None:
+        issue = self.issues[key]
+        issue.fields.status = SimpleNamespace(name=status, id=STATUS_IDS[status])
+        issue.updated = self.__now()
+
+    def __now(self) -> datetime:
+        return datetime.now(self.__tz).replace(tzinfo=None)
+
+    def search_issues(self, jql: str, startAt: int = 0, maxResults: int = 50, fields: str = None,
+                      validate_query: bool = True, **kwargs) -> FakeResultList:
+        self._call("search_issues")
+        if validate_query:
+            # like JIRA, a validated search naming a ticket that does not exist is rejected as a whole
+            named = re.search(r"\bkey\s*(?:in\s*\(([^)]*)\)|=\s*([^\s)]+))", jql, flags=re.IGNORECASE)
+            for key in (named.group(1) or named.group(2)).split(",") if named else []:
+                if key.strip().strip("\"") not in self.issues:
+                    raise JIRAError(status_code=400, text="An issue with key '{0}' does not exist".format(key))
+        matches = [i for i in self.issues.values() if self.__matches(i, jql)]
+        if maxResults is False:
+            return FakeResultList(matches[startAt:], len(matches))
+        return FakeResultList(matches[startAt:startAt + maxResults], len(matches))
+
+    @staticmethod
+    def __matches(issue: SimpleNamespace, jql: str) -> bool:
+        for clause in re.split(r"\s+and\s+", jql, flags=re.IGNORECASE):
+            field, op, value = re.match(r"\s*(\w+)\s*(>=|=|in)\s*(.*?)\s*$", clause).groups()
+            if op == ">=":
+                if issue.updated < datetime.strptime(value.strip("\""), "%Y/%m/%d %H:%M"):
+                    return False
+                continue
+            values = [v.strip().strip("\"").lower() for v in value.strip("()").split(",")]
+            actual = {"project": issue.fields.project.key,
+                      "assignee": issue.fields.assignee.name if issue.fields.assignee else "",
+                      "key": issue.key,
+                      "status": issue.fields.status.name}[field.lower()]
+            if actual.lower() not in values:
+                return False
+        return True
+
+    def issue(self, key: str, fields: str = None) -> SimpleNamespace:
+        self._call("issue")
+        return self.issues[key]
+
+    def transitions(self, issue) -> List[dict]:
+        self._call("transitions")
+        return [{"id": tid, "name": name} for (name, (tid, _)) in TRANSITIONS.items()]
+
+    def find_transitionid_by_name(self, issue, name: str) -> Optional[str]:
+        for t in self.transitions(issue):
+            if t["name"] == name:
+                return t["id"]
+        return None
+
+    def transition_issue(self, issue, transition: str, **kwargs) -> None:
+        self._call("transition_issue")
+        key = issue if isinstance(issue, str) else issue.key
+        for (tid, status) in TRANSITIONS.values():
+            if tid == transition:
+                self.set_status(key, status)
@@ -0,0 +1,191 @@
+"""Load test server.py against in-process fake Slack and JIRA services
+
+Run from the repository root with `python -m benchmarks.load`.  Creates a throwaway DB of synthetic users and
+tickets, runs a number of sweeps through check_active_tickets and then pushes IMs through main()'s event loop,
+printing the results as JSON.
+"""
+from benchmarks.fakes import EndOfEvents, FakeJIRA, FakeSlackSocket
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, time, timedelta
+from pytz import timezone
+from threading import Event, Thread
+import argparse
+import importlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time as clock
+import types
+from typing import List
+
+TIME_ZONE = "America/Los_Angeles"
+# a Wednesday, during everyone's working hours but well clear of the boundaries
+START = datetime(2026, 10, 14, 10, 30)
+
+# every one of these gets a reply, so the time until it arrives can be measured
+MESSAGES = ["help", "get hours", "show team", "set lunch hours 12-1", "pause", "resume", "get stats",
+            "get team stats"]
+
+
+def install_config(args: argparse.Namespace) -> None:
+    """Make server.py's config import resolve to a throwaway config"""
+    config = types.ModuleType("config")
+    config.__dict__.update(slack_token="", jira_server="", jira_user="", jira_pass="", jira_project="BENCH",
+                           time_zone=TIME_ZONE, sweep_mode=args.mode, sweep_workers=args.workers,
+                           sweep_chunk_size=args.chunk_size, session_workers=args.workers, slack_backoff=0.01,
+                           jira_backoff=0.01)
+    sys.modules["config"] = config
+
+
+def populate(jira_conn: FakeJIRA, users: int, rng: random.Random) -> None:
+    """Create active users with zero, one or several tickets in progress each"""
+    from db import db, User, Event, EventTicket, Conversation, PrevTicket, Instance, UserLease, WorkSample, \
+        WorkRollup
+    db.create_tables([User, Event, EventTicket, Conversation, PrevTicket, Instance, UserLease, WorkSample,
+                      WorkRollup])
+    with db.atomic():
+        for n in range(users):
+            username = "user{0}".format(n)
+            User.create(username=username, active=True, off_time=time(hour=17))
+            for t in range(rng.choice([0, 1, 1, 1, 2, 3])):
+                jira_conn.add_issue("BENCH-{0}-{1}".format(n, t), username, "In Progress")
+            jira_conn.add_issue("BENCH-{0}-old".format(n), username, "On Hold")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="nagbot-bench-")
+    slack = FakeSlackSocket(args.slack_latency, args.slack_error_rate)
+    jira_conn = FakeJIRA(timezone(TIME_ZONE), args.jira_latency, args.jira_error_rate)
+    install_config(args)
+
+    import db
+    db.db.init(os.path.join(workdir, "bench.db"))
+    populate(jira_conn, args.users, rng)
+
+    peak_threads = [threading.active_count()]
+    done = Event()
+
+    def sample_threads() -> None:
+        while not done.wait(0.01):
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    Thread(target=sample_threads, daemon=True).start()
+
+    started = clock.perf_counter()
+    server = importlib.import_module("server")
+    import_seconds = clock.perf_counter() - started
+    # server.py's clients are only created on first use, so the fakes can be swapped in before anything connects
+    server.slack_sock.set(slack)
+    server.jira_session.set(jira_conn)
+    tz = timezone(TIME_ZONE)
+    now = [tz.localize(START)]
+
+    class FrozenDatetime(datetime):
+        """datetime whose now() follows the simulated clock"""
+
+        @classmethod
+        def now(cls, tz=None):
+            return now[0].astimezone(tz) if tz else now[0].replace(tzinfo=None)
+
+    server.datetime = FrozenDatetime
+
+    # main() wires up and starts everything, its own sweep timer is stopped so only the sweeps below run
+    loop = Thread(target=lambda: _run_main(server), daemon=True)
+    loop.start()
+    while server.sweep_scheduler is None:
+        clock.sleep(0.01)
+    server.sweep_scheduler.stop()
+
+    sweeps = []
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    for _ in range(args.sweeps):
+        calls_before = sum(jira_conn.calls.values())
+        started = clock.perf_counter()
+        jobs = server.check_active_tickets()
+        done_jobs, _ = wait([pool.submit(job) for job in jobs])
+        sweeps.append({"wall_seconds": round(clock.perf_counter() - started, 4), "jobs": len(jobs),
+                       "jira_calls": sum(jira_conn.calls.values()) - calls_before,
+                       # jobs that raised, these skipped some of their users
+                       "errors": sum(1 for f in done_jobs if f.exception() is not None)})
+        now[0] += timedelta(seconds=args.interval)
+
+    # replies to the nags sent above land on whichever sessions the sweeps opened
+    started = clock.perf_counter()
+    for n in range(args.messages):
+        slack.push_message("user{0}".format(rng.randrange(args.users)), rng.choice(MESSAGES))
+        if args.message_rate:
+            clock.sleep(1.0 / args.message_rate)
+    deadline = clock.time() + args.timeout
+    while len(slack.reply_latencies) < args.messages and clock.time() < deadline:
+        clock.sleep(0.01)
+    message_seconds = clock.perf_counter() - started
+    slack.close()
+    done.set()
+
+    latencies = [latency * 1000 for latency in slack.reply_latencies]
+    return {
+        "users": args.users,
+        "tickets": len(jira_conn.issues),
+        "mode": args.mode,
+        "import_seconds": round(import_seconds, 4),
+        "sweeps": sweeps,
+        "sweep_wall_seconds_mean": round(sum(s["wall_seconds"] for s in sweeps) / max(1, len(sweeps)), 4),
+        "errors": sum(s["errors"] for s in sweeps),
+        "jira_calls_per_sweep_mean": round(sum(s["jira_calls"] for s in sweeps) / max(1, len(sweeps)), 2),
+        "jira_calls": dict(jira_conn.calls),
+        "slack_calls": dict(slack.calls),
+        "messages": {"sent": args.messages, "answered": len(latencies), "seconds": round(message_seconds, 4),
+                     "latency_ms": {"p50": round(percentile(latencies, 50), 2),
+                                    "p90": round(percentile(latencies, 90), 2),
+                                    "p99": round(percentile(latencies, 99), 2),
+                                    "max": round(max(latencies), 2) if latencies else 0.0}},
+        "peak_threads": peak_threads[0],
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin"
+                                                                              else 1),
+    }
+
+
+def _run_main(server: types.ModuleType) -> None:
+    try:
+        server.main()
+    except EndOfEvents:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sweeps", type=int, default=6, help="sweeps to run, the clock advances --interval between")
+    parser.add_argument("--interval", type=int, default=300, help="simulated seconds between sweeps")
+    parser.add_argument("--messages", type=int, default=500, help="IMs pushed through main()'s event loop")
+    parser.add_argument("--message-rate", type=float, default=0, help="IMs a second, 0 to push them all at once")
+    parser.add_argument("--mode", choices=["batched", "incremental"], default="batched")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--jira-latency", type=float, default=0.02, help="seconds added to every JIRA call")
+    parser.add_argument("--jira-error-rate", type=float, default=0.0)
+    parser.add_argument("--slack-latency", type=float, default=0.005, help="seconds added to every Slack call")
+    parser.add_argument("--slack-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for replies to every IM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    results = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(results + "\n")
+    else:
+        print(results)
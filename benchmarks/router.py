@@ -0,0 +1,35 @@
+"""Messages per second through the command routers
+
+Run from the repository root with `python -m benchmarks.router`.
+"""
+from commands import COMMANDS, CONTEXT_COMMANDS, build_routers
+import argparse
+import json
+import time
+
+# a mix of what people actually send, weighted towards the cheap commands
+MESSAGES = [
+    "help", "yes", "no", "2", "pause", "resume", "get hours", "show team",
+    "set hours 9-5", "set hours 8:30am - 4:45pm", "set lunch hours 12-1", "set lunch hours 11:30 am-12:15 pm",
+    "what is this", "thanks!",
+]
+
+
+def run(iterations: int) -> dict:
+    names = [name for (name, _) in COMMANDS] + [name for cmds in CONTEXT_COMMANDS.values() for (name, _) in cmds]
+    routers = build_routers({name: lambda s, m: None for name in names})
+    results = {}
+    for (conflict_type, router) in routers.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for message in MESSAGES:
+                router.dispatch(None, message)
+        elapsed = time.perf_counter() - start
+        results[conflict_type or "none"] = round(iterations * len(MESSAGES) / elapsed)
+    return {"commands": len(names), "messages_per_second": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=20000, help="passes over the message mix")
+    print(json.dumps(run(parser.parse_args().iterations), indent=2))
@@ -0,0 +1,89 @@
+import re
+from datetime import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# HH(:MM)?(AM|PM)?-HH(:MM)?(AM|PM)?, start hours default to AM and end hours to PM
+HOURS = r"(\d{1,2})(?::(\d{1,2}))? ?(am|pm)? ?- ?(\d+)(?::(\d{1,2}))? ?(am|pm)?"
+
+# (name, grammar) of the commands available in every conversation, checked in order
+COMMANDS = [
+    ("help", "help"),
+    ("inactivate", "inactivate"),
+    ("pause", "pause"),
+    ("resume", "resume"),
+    ("show_opts", r"(?:get|show) (?:hours|options|settings)"),
+    ("show_stats", r"(?:get|show) (?:my )?stats"),
+    ("show_team_stats", r"(?:get|show) team stats"),
+    ("show_people", r"(?:get|show) (?:people|team)"),
+    ("set_hours", "set hours " + HOURS),
+    ("set_lunch_hours", "set lunch hours " + HOURS),
+]
+
+# commands layered on top of COMMANDS while an event of the given conflict type is being resolved
+CONTEXT_COMMANDS = {
+    "on_over": [("choose_ticket", r"\d+")],
+    "on_under": [("resume_prev", "yes"), ("dismiss", "no|resolve")],
+    "off_over": [("halt_all", "yes"), ("dismiss", "no")],
+}
+
+# (session, match) -> None, match is None for commands that are a plain word or phrase
+Handler = Callable[[Any, Any], None]
+
+_LITERAL = re.compile(r"[a-z ]+$")
+
+
+def parse_hours(match: Any) -> Tuple[time, time]:
+    """Start and end time from a match of HOURS"""
+    return (time(hour=int(match.group(1)) if match.group(3) != "pm" else int(match.group(1)) + 12,
+                 minute=int(match.group(2)) if match.group(2) else 0),
+            time(hour=int(match.group(4)) + 12 if match.group(6) != "am" else int(match.group(4)),
+                 minute=int(match.group(5)) if match.group(5) else 0))
+
+
+class CommandRouter(object):
+    """Route a message to the handler of the command whose grammar matches all of it
+
+    Plain word commands are found with a dict lookup, the rest are tried in order with precompiled patterns.  A router
+    built with a parent falls back to the parent's commands when none of its own match.
+    """
+
+    def __init__(self, commands: List[Tuple[str, str]], handlers: Dict[str, Handler],
+                 parent: "CommandRouter" = None) -> None:
+        self.__literals = dict(parent.__literals) if parent else {}  # type: Dict[str, Handler]
+        self.__patterns = []  # type: List[Tuple[Any, Handler]]
+        for (name, grammar) in commands:
+            if _LITERAL.match(grammar):
+                self.__literals[grammar] = handlers[name]
+            else:
+                # grouped so the anchor applies to every alternative, not just the last one
+                self.__patterns.append((re.compile("(?:{0})$".format(grammar)), handlers[name]))
+        if parent:
+            self.__patterns += parent.__patterns
+
+    def dispatch(self, session: Any, message: str) -> bool:
+        """Run the handler for a message, returning whether any command matched"""
+        handler = self.__literals.get(message)
+        if handler:
+            handler(session, None)
+            return True
+        for (pattern, handler) in self.__patterns:
+            match = pattern.match(message)
+            if match:
+                handler(session, match)
+                return True
+        return False
+
+
+def build_routers(handlers: Dict[str, Handler]) -> Dict[Optional[str], CommandRouter]:
+    """A router per conflict type, plus one under None for conversations without an event
+
+    handlers must have exactly one handler for each command name in COMMANDS and CONTEXT_COMMANDS.
+    """
+    names = {name for (name, _) in COMMANDS} | {name for cmds in CONTEXT_COMMANDS.values() for (name, _) in cmds}
+    if set(handlers) != names:
+        raise ValueError("Commands without a handler: {0}, handlers without a command: {1}"
+                         .format(sorted(names - set(handlers)) or "none", sorted(set(handlers) - names) or "none"))
+    routers = {None: CommandRouter(COMMANDS, handlers)}  # type: Dict[Optional[str], CommandRouter]
+    for (conflict_type, commands) in CONTEXT_COMMANDS.items():
+        routers[conflict_type] = CommandRouter(commands, handlers, routers[None])
+    return routers
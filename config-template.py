@@ -10,3 +10,69 @@ jira_pass = "PASSWORD123"
 jira_project = "PROJ"
 # Local timezone
 time_zone = "America/Los_Angeles"
+# Number of users to look up per JIRA search during a sweep
+sweep_chunk_size = 50
+# Seconds between sweeps
+sweep_interval = 300
+# Maximum number of sweep jobs talking to JIRA at once
+sweep_workers = 4
+# Seconds over which each sweep's jobs are spread out
+sweep_spread = 120
+# "batched" searches every user's tickets each sweep, "incremental" only fetches tickets updated since the last one
+sweep_mode = "batched"
+# Seconds between full resyncs of the incremental ticket cache
+resync_interval = 3600
+# Seconds to cache workflow transition ids for
+transition_ttl = 3600
+# Maximum number of tickets transitioned at once
+transition_workers = 6
+# Threads shared by every conversation with the bot
+session_workers = 4
+# Seconds a user has to reply to a prompt
+conversation_timeout = 1800
+# Most sessions kept in memory at once
+max_sessions = 1000
+# Seconds a finished session is kept around
+session_idle_ttl = 3600
+# Seconds between checks of a user who is not near the start or end of work or lunch
+idle_poll_interval = 900
+# Seconds either side of the start or end of work or lunch during which a user is checked every sweep
+boundary_window = 900
+# Port to listen on for JIRA issue webhooks, None to only poll JIRA
+webhook_port = None
+# Address to listen on for webhooks, "" for every interface
+webhook_host = ""
+# Shared secret JIRA must pass as ?secret=... on the webhook URL, None to accept any request
+webhook_secret = None
+# Seconds between polls for missed changes while webhooks are enabled
+reconcile_interval = 1800
+# Messages a second the bot may post to each Slack channel, and how many it may post at once before that applies
+slack_rate = 1.0
+slack_burst = 3
+# Times a failed Slack post is retried, and the delay in seconds before the first retry (doubled for each after it)
+slack_retries = 5
+slack_backoff = 1.0
+# Port to serve Prometheus metrics on at /metrics, None to disable
+metrics_port = None
+# Address to serve metrics on, keep it local unless the port is firewalled
+metrics_host = "127.0.0.1"
+# Log how long each sweep took from its tick, spread included, and how long its jobs spent running
+log_sweeps = False
+# Connections kept open to JIRA, at least sweep_workers + transition_workers + session_workers
+jira_pool_size = 16
+# Seconds to wait for JIRA to answer a request
+jira_timeout = 30
+# Times a throttled or failed JIRA call is retried, and the delay in seconds before the first retry (doubled for each
+# after it)
+jira_retries = 3
+jira_backoff = 1.0
+# Failed JIRA calls in a row after which sweeps and nags pause, and the seconds to wait before trying JIRA again
+jira_failure_threshold = 5
+jira_reset_timeout = 60
+# Unique name of this instance when several share the DB and split users between them, None to handle every user
+shard_id = None
+# Seconds an instance keeps a user after it stops renewing, another instance takes the user over after that
+lease_ttl = 60
+# Days to keep each check's raw work sample, and days to keep hourly totals of them (daily totals are kept forever)
+sample_retention_days = 14
+hourly_retention_days = 90
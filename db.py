@@ -1,10 +1,18 @@
 from peewee import *
 from playhouse.sqlite_ext import SqliteExtDatabase
 from datetime import time
-import json
+import hashlib
 from typing import List
 
-db = SqliteExtDatabase("gudbot.db")
+# WAL lets the sweep and session threads read while another thread writes, busy_timeout makes writers queue up
+# instead of failing straight away with "database is locked"
+db = SqliteExtDatabase("gudbot.db", pragmas=(("journal_mode", "wal"), ("synchronous", "normal"),
+                                             ("busy_timeout", 5000)))
+
+
+def ticket_set_hash(ticket_keys: List[str]) -> str:
+    """Canonical hash of a set of ticket keys, independent of order and duplicates"""
+    return hashlib.sha1("\n".join(sorted(set(ticket_keys))).encode()).hexdigest()
 
 
 class BaseModel(Model):
@@ -23,19 +31,90 @@ class User(BaseModel):
 
 class Event(BaseModel):
     user = ForeignKeyField(User, related_name="events")
-    __tickets_affected = TextField(null=True)
+    # ticket_set_hash of the affected tickets, so events for the same set can be found without loading them
+    tickets_hash = CharField(null=True)
     active = BooleanField(default=True)
     conflict_type = CharField()
 
+    class Meta:
+        indexes = (
+            (("user", "active", "conflict_type", "tickets_hash"), False),
+        )
+
     @property
     def tickets_affected(self) -> List[str]:
-        return json.loads(self.__tickets_affected) if self.__tickets_affected else []
+        return [t.ticket_key for t in self.tickets.order_by(EventTicket.position)]
+
 
-    @tickets_affected.setter
-    def tickets_affected(self, val: List[str]):
-        self.__tickets_affected = json.dumps(val) if val else None
+class EventTicket(BaseModel):
+    event = ForeignKeyField(Event, related_name="tickets")
+    ticket_key = CharField(index=True)
+    position = IntegerField()
+    # as shown to the user when they were asked about the event
+    summary = CharField(null=True)
+
+    class Meta:
+        indexes = (
+            (("event", "ticket_key"), True),
+        )
+
+
+class Conversation(BaseModel):
+    """A prompt about an event that is still waiting on the user's reply, enough to pick it back up after a restart"""
+    event = ForeignKeyField(Event, related_name="conversations", unique=True)
+    channel_id = CharField()
+    prompt = TextField()
+    prev_ticket = CharField(null=True)
+    # UTC time the user has until to reply
+    expires = DateTimeField(index=True)
 
 
 class PrevTicket(BaseModel):
     user = ForeignKeyField(User, related_name="prev_tickets")
     ticket_key = CharField()
+
+
+class Instance(BaseModel):
+    """A bot process taking part in sharding, alive while its heartbeat is recent"""
+    name = CharField(unique=True)
+    heartbeat = DateTimeField()
+
+
+class UserLease(BaseModel):
+    """Which instance owns a user, the owner may only act for the user until the lease expires"""
+    user = ForeignKeyField(User, related_name="lease", unique=True)
+    owner = CharField(null=True, index=True)
+    expires = DateTimeField()
+
+
+class WorkSample(BaseModel):
+    """What a user had 'In Progress' when they were checked, one row per ticket or one with no ticket"""
+    user = ForeignKeyField(User, related_name="samples")
+    # local time of the check
+    taken_at = DateTimeField()
+    phase = CharField()
+    ticket_key = CharField(default="")
+    # share of the time since the user's previous check credited to this ticket
+    seconds = IntegerField()
+
+    class Meta:
+        indexes = (
+            (("user", "taken_at"), False),
+        )
+
+
+class WorkRollup(BaseModel):
+    """Running totals of WorkSample per user, ticket and phase over an hour or a day"""
+    user = ForeignKeyField(User, related_name="rollups")
+    period = CharField()
+    start = DateTimeField()
+    phase = CharField()
+    ticket_key = CharField(default="")
+    seconds = IntegerField(default=0)
+    samples = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (("user", "period", "start", "phase", "ticket_key"), True),
+            (("period", "start"), False),
+        )
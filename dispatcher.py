@@ -0,0 +1,119 @@
+from collections import deque
+from threading import Condition, Thread
+import heapq
+import itertools
+import logging
+import queue
+import time
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# placed in a session's mailbox when its conversation window runs out
+EXPIRE = object()
+
+
+class Dispatcher(object):
+    """Drive every session from a fixed pool of worker threads
+
+    A session is anything with a handle(message) method, an expire() method and an active flag.  Messages for one
+    session are always handled one at a time and in order.  While a session stays active after handling a message, it
+    is expired once timeout seconds pass without another message arriving.
+    """
+
+    def __init__(self, workers: int, timeout: float) -> None:
+        self.__workers = workers
+        self.__timeout = timeout
+        self.__ready = queue.Queue()  # type: queue.Queue
+        self.__cond = Condition()
+        self.__mailboxes = {}  # type: Dict[Any, deque]
+        self.__deadlines = {}  # type: Dict[Any, float]
+        self.__heap = []  # type: List[Tuple[float, int, Any]]
+        self.__seq = itertools.count()
+
+    def start(self) -> None:
+        """Start the worker and expiry threads"""
+        for _ in range(self.__workers):
+            t = Thread(target=self.__work)
+            t.daemon = True
+            t.start()
+        t = Thread(target=self.__expire)
+        t.daemon = True
+        t.start()
+
+    def post(self, session: Any, message: Any) -> None:
+        """Queue a message for a session"""
+        with self.__cond:
+            self.__deliver(session, message)
+
+    def watch(self, session: Any, deadline: float = None) -> None:
+        """Start the conversation window of a session that is waiting on a reply, optionally ending at deadline"""
+        with self.__cond:
+            self.__arm(session, deadline)
+
+    @property
+    def pending(self) -> int:
+        """Number of sessions waiting on a reply"""
+        with self.__cond:
+            return len(self.__deadlines)
+
+    @property
+    def queued(self) -> int:
+        """Number of messages waiting to be handled"""
+        with self.__cond:
+            return sum(len(m) for m in self.__mailboxes.values())
+
+    def __deliver(self, session: Any, message: Any) -> None:
+        """Add a message to a session's mailbox, marking the session ready if it was idle"""
+        if session in self.__mailboxes:
+            self.__mailboxes[session].append(message)
+        else:
+            self.__mailboxes[session] = deque([message])
+            self.__ready.put(session)
+
+    def __arm(self, session: Any, deadline: float = None) -> None:
+        deadline = deadline or time.time() + self.__timeout
+        self.__deadlines[session] = deadline
+        heapq.heappush(self.__heap, (deadline, next(self.__seq), session))
+        self.__cond.notify()
+
+    def __work(self) -> None:
+        """Handle messages for whichever session is ready next"""
+        while True:
+            session = self.__ready.get()
+            with self.__cond:
+                message = self.__mailboxes[session].popleft()
+            try:
+                if message is EXPIRE:
+                    session.expire()
+                else:
+                    session.handle(message)
+            except Exception:
+                logger.exception("Session failed to handle message")
+            with self.__cond:
+                if session.active:
+                    self.__arm(session)
+                else:
+                    self.__deadlines.pop(session, None)
+                if self.__mailboxes[session]:
+                    self.__ready.put(session)
+                else:
+                    del self.__mailboxes[session]
+
+    def __expire(self) -> None:
+        """Post EXPIRE to sessions whose conversation window has run out"""
+        with self.__cond:
+            while True:
+                if not self.__heap:
+                    self.__cond.wait()
+                    continue
+                deadline, _, session = self.__heap[0]
+                if deadline > time.time():
+                    self.__cond.wait(deadline - time.time())
+                    continue
+                heapq.heappop(self.__heap)
+                # stale entries are left in the heap when a window is extended or closed
+                if self.__deadlines.get(session) != deadline:
+                    continue
+                del self.__deadlines[session]
+                self.__deliver(session, EXPIRE)
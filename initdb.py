@@ -1,5 +1,40 @@
 from db import *
+from repository import store_tickets
+from playhouse.migrate import SqliteMigrator, migrate
+import json
+
+
+def upgrade() -> None:
+    """Bring a DB created by an older version up to date"""
+    migrator = SqliteMigrator(db)
+    columns = {c.name for c in db.get_columns("event")}
+    if "tickets_hash" not in columns:
+        migrate(migrator.add_column("event", "tickets_hash", Event.tickets_hash))
+
+    # affected tickets used to be stored as a JSON list on the event itself
+    if "_Event__tickets_affected" in columns:
+        db.create_tables([EventTicket], safe=True)
+        rows = db.execute_sql("SELECT id, _Event__tickets_affected FROM event "
+                              "WHERE _Event__tickets_affected IS NOT NULL").fetchall()
+        with db.atomic():
+            for (event_id, tickets) in rows:
+                store_tickets(event_id, json.loads(tickets))
+        migrate(migrator.drop_column("event", "_Event__tickets_affected"))
+
+    if EventTicket.table_exists() and "summary" not in {c.name for c in db.get_columns("eventticket")}:
+        migrate(migrator.add_column("eventticket", "summary", EventTicket.summary))
+
+    indexes = {i.name for i in db.get_indexes("event")}
+    if "event_user_id_active_conflict_type" in indexes:
+        migrate(migrator.drop_index("event", "event_user_id_active_conflict_type"))
+    if "event_user_id_active_conflict_type_tickets_hash" not in indexes:
+        migrate(migrator.add_index("event", ("user_id", "active", "conflict_type", "tickets_hash"), False))
+
 
 if __name__ == "__main__":
     db.connect()
-    db.create_tables([User, Event, PrevTicket])
+    # migrate before creating anything so new indexes never reference columns that are not there yet
+    if Event.table_exists():
+        upgrade()
+    db.create_tables([User, Event, EventTicket, Conversation, PrevTicket, Instance, UserLease, WorkSample,
+                     WorkRollup], safe=True)
@@ -0,0 +1,136 @@
+from jira import JIRA
+from jira.exceptions import JIRAError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from threading import Lock
+import logging
+import random
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# calls that are safe to repeat after a server error, anything else is only retried when JIRA throttled it
+IDEMPOTENT = {"search_issues", "issue", "transitions", "find_transitionid_by_name", "server_info"}
+# longest Retry-After honoured, so a throttled call can't hold up a sweep indefinitely
+MAX_RETRY_AFTER = 60.0
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling JIRA while it is considered unhealthy"""
+
+
+def connect(server: str, basic_auth: tuple, pool_size: int, timeout: float) -> JIRA:
+    """Open a JIRA connection whose HTTP pool can serve pool_size threads at once
+
+    The library's own retries are turned off, JiraClient takes care of those.
+    """
+    conn = JIRA(server=server, basic_auth=basic_auth, timeout=timeout, max_retries=0)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    conn._session.mount("https://", adapter)
+    conn._session.mount("http://", adapter)
+    return conn
+
+
+def is_transient(e: Exception) -> bool:
+    """Whether an error says more about JIRA's health than about the request"""
+    if isinstance(e, (ConnectionError, Timeout)):
+        return True
+    status = getattr(e, "status_code", None)
+    return isinstance(e, JIRAError) and (status == 429 or (status or 0) >= 500)
+
+
+class CircuitBreaker(object):
+    """Stop calling a service after too many consecutive failures
+
+    Once threshold failures in a row have been recorded the circuit opens and calls are refused for reset_timeout
+    seconds.  After that calls are let through again, the first success closes the circuit and a failure opens it for
+    another reset_timeout.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.__threshold = threshold
+        self.__reset_timeout = reset_timeout
+        self.__lock = Lock()
+        self.__failures = 0
+        self.__opened_at = None  # type: Optional[float]
+
+    @property
+    def healthy(self) -> bool:
+        """Whether calls are currently let through"""
+        with self.__lock:
+            return self.__opened_at is None or time.time() >= self.__opened_at + self.__reset_timeout
+
+    def success(self) -> None:
+        with self.__lock:
+            if self.__opened_at is not None:
+                logger.info("JIRA is reachable again, closing circuit")
+            self.__failures = 0
+            self.__opened_at = None
+
+    def failure(self) -> None:
+        with self.__lock:
+            self.__failures += 1
+            # a failed trial call reopens the circuit straight away
+            if self.__failures >= self.__threshold or self.__opened_at is not None:
+                if self.__opened_at is None:
+                    logger.warning("%d JIRA calls failed in a row, pausing calls for %ds", self.__failures,
+                                   self.__reset_timeout)
+                self.__opened_at = time.time()
+
+
+class JiraClient(object):
+    """Thread safe access to JIRA with retries and a circuit breaker
+
+    Any method of the wrapped connection can be called on the client, its other attributes are not exposed.  Calls
+    failing because JIRA throttled them, errored or could not be reached are retried up to max_retries times with
+    jittered exponential backoff, honouring Retry-After when JIRA sends one.  Only calls in IDEMPOTENT are retried after
+    a server error.  While the breaker is open calls raise CircuitOpen without touching JIRA.
+    """
+
+    def __init__(self, conn: Any, max_retries: int, backoff: float, breaker: CircuitBreaker) -> None:
+        self.__conn = conn
+        self.__max_retries = max_retries
+        self.__backoff = backoff
+        self.__breaker = breaker
+
+    @property
+    def healthy(self) -> bool:
+        return self.__breaker.healthy
+
+    def __getattr__(self, name: str) -> Any:
+        return lambda *args, **kwargs: self.__call(name, args, kwargs)
+
+    def __call(self, name: str, args: tuple, kwargs: dict) -> Any:
+        if not self.__breaker.healthy:
+            raise CircuitOpen("JIRA is unavailable")
+        attempt = 0
+        while True:
+            try:
+                # looked up on every attempt, a lazily opened connection is retried along with the call
+                result = getattr(self.__conn, name)(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # the request was wrong, JIRA itself answered fine
+                    self.__breaker.success()
+                    raise
+                if attempt >= self.__max_retries or not (name in IDEMPOTENT or
+                                                         getattr(e, "status_code", None) == 429):
+                    self.__breaker.failure()
+                    raise
+                attempt += 1
+                delay = self.__retry_after(e) or self.__backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.warning("JIRA %s failed, retrying in %.1fs: %s", name, delay, e)
+                time.sleep(delay)
+                continue
+            self.__breaker.success()
+            return result
+
+    @staticmethod
+    def __retry_after(e: Exception) -> Optional[float]:
+        """Delay JIRA asked for in the Retry-After header of a throttled response"""
+        response = getattr(e, "response", None)
+        try:
+            return min(float(response.headers["Retry-After"]), MAX_RETRY_AFTER)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
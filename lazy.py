@@ -0,0 +1,34 @@
+from threading import Lock
+from typing import Any, Callable
+
+
+class Lazy(object):
+    """Stand-in for an object that is only created the first time it is used
+
+    Attribute access is forwarded to the object, creating it with factory on first use.  If the factory raises, the
+    next access tries again.
+    """
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        self.__factory = factory
+        self.__lock = Lock()
+        self.__value = None  # type: Any
+        self.__created = False
+
+    def get(self) -> Any:
+        """The object, created now if it does not exist yet"""
+        if not self.__created:
+            with self.__lock:
+                if not self.__created:
+                    self.__value = self.__factory()
+                    self.__created = True
+        return self.__value
+
+    def set(self, value: Any) -> None:
+        """Use value instead of calling the factory, e.g. to substitute a fake"""
+        with self.__lock:
+            self.__value = value
+            self.__created = True
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
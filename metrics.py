@@ -0,0 +1,200 @@
+"""Counters, gauges and latency histograms served in the Prometheus text format"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+import bisect
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join("{0}=\"{1}\"".format(k, str(v).replace("\\", "\\\\").replace("\"", "\\\""))
+                          for (k, v) in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class _Metric(object):
+    kind = ""
+
+    def __init__(self, name: str, doc: str) -> None:
+        self.name = name
+        self.doc = doc
+        self._lock = Lock()
+
+    def render(self) -> List[str]:
+        return ["# HELP {0} {1}".format(self.name, self.doc), "# TYPE {0} {1}".format(self.name, self.kind)] + \
+            self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, one per distinct set of labels"""
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str) -> None:
+        super().__init__(name, doc)
+        self.__values = {}  # type: Dict[Labels, float]
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return ["{0}{1} {2}".format(self.name, _format_labels(k), _format_value(v))
+                    for (k, v) in sorted(self.__values.items())]
+
+
+class Gauge(_Metric):
+    """Value read from a callback whenever the metrics are rendered"""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, read: Callable[[], float]) -> None:
+        super().__init__(name, doc)
+        self.__read = read
+
+    def _samples(self) -> List[str]:
+        return ["{0} {1}".format(self.name, _format_value(self.__read()))]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, usually durations in seconds"""
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, doc)
+        self.__buckets = buckets
+        # labels -> (count per bucket with the last one for +Inf, sum)
+        self.__values = {}  # type: Dict[Labels, Tuple[List[int], float]]
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self.__values.get(key, ([0] * (len(self.__buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.__buckets, value)] += 1
+            self.__values[key] = (counts, total + value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for (key, (counts, total)) in sorted(self.__values.items()):
+                cumulative = 0
+                for (bound, count) in zip(self.__buckets + (float("inf"),), counts):
+                    cumulative += count
+                    lines.append("{0}_bucket{1} {2}".format(self.name,
+                                                            _format_labels(key, (("le", _format_value(bound)),)),
+                                                            cumulative))
+                lines.append("{0}_sum{1} {2}".format(self.name, _format_labels(key), _format_value(total)))
+                lines.append("{0}_count{1} {2}".format(self.name, _format_labels(key), cumulative))
+        return lines
+
+
+class Registry(object):
+    def __init__(self) -> None:
+        self.__metrics = []  # type: List[_Metric]
+
+    def register(self, metric: _Metric) -> Any:
+        self.__metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for m in self.__metrics for line in m.render()) + "\n"
+
+
+class Instrumented(object):
+    """Proxy counting and timing every method call made on the wrapped object, labelled by method name"""
+
+    def __init__(self, wrapped: Any, calls: Counter, seconds: Histogram) -> None:
+        self.__wrapped = wrapped
+        self.__calls = calls
+        self.__seconds = seconds
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.__wrapped, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                self.__calls.inc(method=name, outcome="error")
+                raise
+            finally:
+                self.__seconds.observe(time.perf_counter() - start, method=name)
+            self.__calls.inc(method=name, outcome="ok")
+            return result
+        return call
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """Serve a registry's metrics over HTTP at /metrics"""
+
+    def __init__(self, registry: Registry, host: str, port: int) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt: str, *args) -> None:
+                pass
+
+        self.__server = _ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def port(self) -> int:
+        return self.__server.server_address[1]
+
+    def start(self) -> None:
+        t = Thread(target=self.__server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+
+
+REGISTRY = Registry()
+
+sweep_seconds = REGISTRY.register(Histogram("nagbot_sweep_seconds",
+                                            "Time from a sweep's tick to its last job finishing, spread included"))
+sweep_job_seconds = REGISTRY.register(Histogram("nagbot_sweep_job_seconds",
+                                                "Time each sweep job spent running, not counting its wait to start"))
+users_checked = REGISTRY.register(Counter("nagbot_users_checked_total", "Users whose tickets were checked"))
+events_created = REGISTRY.register(Counter("nagbot_events_total", "Events raised with users, by conflict type"))
+jira_calls = REGISTRY.register(Counter("nagbot_jira_calls_total", "JIRA client calls, by method and outcome"))
+jira_seconds = REGISTRY.register(Histogram("nagbot_jira_call_seconds", "JIRA client call latency, by method"))
+slack_calls = REGISTRY.register(Counter("nagbot_slack_calls_total", "Slack API calls, by method and outcome"))
+slack_seconds = REGISTRY.register(Histogram("nagbot_slack_call_seconds", "Slack API call latency, by method"))
+sessions_started = REGISTRY.register(Counter("nagbot_sessions_started_total",
+                                             "Sessions started, by whether a sweep or a message from the user started "
+                                             "them"))
+sessions_expired = REGISTRY.register(Counter("nagbot_sessions_expired_total",
+                                             "Sessions whose user did not reply in time, by whether an event was "
+                                             "left unresolved"))
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from threading import Condition, Thread
+import logging
+import random
+import time
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# longest post made by merging queued messages, a single longer message is still sent on its own
+MAX_LENGTH = 4000
+
+
+class _Channel(object):
+    """Queued messages and token bucket of one channel"""
+
+    def __init__(self, burst: int) -> None:
+        self.pending = []  # type: List[str]
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.attempts = 0
+        self.retry_at = 0.0
+
+
+class Outbox(object):
+    """Deliver messages from a single queue on a background thread
+
+    Each channel gets a token bucket of burst posts refilled at rate posts a second.  Messages queued for a channel
+    while it waits for a token are merged into one post.  A failed post is retried with jittered exponential backoff
+    up to max_retries times before its messages are dropped.
+    """
+
+    def __init__(self, post: Callable[[str, str], None], rate: float, burst: int, max_retries: int,
+                 backoff: float) -> None:
+        self.__post = post
+        self.__rate = rate
+        self.__burst = burst
+        self.__max_retries = max_retries
+        self.__backoff = backoff
+        self.__cond = Condition()
+        self.__channels = OrderedDict()  # type: Dict[str, _Channel]
+
+    def start(self) -> None:
+        """Start the delivery thread"""
+        t = Thread(target=self.__run)
+        t.daemon = True
+        t.start()
+
+    def send(self, channel_id: str, text: str) -> None:
+        """Queue a message, it is posted as soon as the channel's rate limit allows"""
+        with self.__cond:
+            if channel_id not in self.__channels:
+                self.__channels[channel_id] = _Channel(self.__burst)
+            self.__channels[channel_id].pending.append(text)
+            self.__cond.notify()
+
+    @property
+    def depth(self) -> int:
+        """Number of messages waiting to be posted"""
+        with self.__cond:
+            return sum(len(c.pending) for c in self.__channels.values())
+
+    def __run(self) -> None:
+        while True:
+            with self.__cond:
+                channel_id, channel, text = self.__next()
+            try:
+                self.__post(channel_id, text)
+                channel.attempts = 0
+            except Exception:
+                with self.__cond:
+                    self.__retry(channel_id, channel, text)
+
+    def __next(self) -> tuple:
+        """Wait for a channel with messages and a token, returning it with its merged messages"""
+        while True:
+            now = time.time()
+            wait = None
+            for (channel_id, channel) in list(self.__channels.items()):
+                channel.tokens = min(self.__burst, channel.tokens + (now - channel.updated) * self.__rate)
+                channel.updated = now
+                if not channel.pending:
+                    # forget idle channels once their bucket is full again
+                    if channel.tokens >= self.__burst:
+                        del self.__channels[channel_id]
+                    continue
+                ready_at = max(channel.retry_at, now + (1 - channel.tokens) / self.__rate)
+                if ready_at <= now:
+                    channel.tokens -= 1
+                    # go to the back of the line so busy channels can't starve the rest
+                    self.__channels.move_to_end(channel_id)
+                    return channel_id, channel, self.__take(channel)
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+            self.__cond.wait(wait)
+
+    @staticmethod
+    def __take(channel: _Channel) -> str:
+        """Pop as many queued messages as fit in one post"""
+        count = 1
+        length = len(channel.pending[0])
+        while count < len(channel.pending) and length + 1 + len(channel.pending[count]) <= MAX_LENGTH:
+            length += 1 + len(channel.pending[count])
+            count += 1
+        text = "\n".join(channel.pending[:count])
+        del channel.pending[:count]
+        return text
+
+    def __retry(self, channel_id: str, channel: _Channel, text: str) -> None:
+        """Put a failed post back at the front of its channel's queue, or drop it if it has failed too often"""
+        # the channel may have been forgotten and recreated while the post was in flight
+        channel = self.__channels.setdefault(channel_id, channel)
+        channel.attempts += 1
+        if channel.attempts > self.__max_retries:
+            logger.exception("Dropping message to %s after %d attempts", channel_id, channel.attempts)
+            channel.attempts = 0
+            return
+        logger.warning("Failed to post to %s, retrying", channel_id, exc_info=True)
+        channel.retry_at = time.time() + self.__backoff * 2 ** (channel.attempts - 1) * random.uniform(0.5, 1.5)
+        channel.pending.insert(0, text)
+        self.__cond.notify()
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from db import User
+from threading import Lock
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class SessionRegistry(object):
+    """Sessions by username, least recently used first
+
+    Sessions that are no longer active are evicted once they have been idle for idle_ttl seconds, or oldest first
+    whenever the registry holds more than max_size sessions.  Active sessions are never evicted since the user may
+    still reply to them.
+    """
+
+    def __init__(self, max_size: int, idle_ttl: float) -> None:
+        self.__max_size = max_size
+        self.__idle_ttl = idle_ttl
+        self.__lock = Lock()
+        self.__sessions = OrderedDict()  # type: Dict[str, Tuple[Any, float]]
+
+    def get(self, username: str) -> Optional[Any]:
+        """Session for a user, if there is one"""
+        with self.__lock:
+            if username not in self.__sessions:
+                return None
+            session = self.__sessions.pop(username)[0]
+            self.__sessions[username] = (session, time.time())
+            return session
+
+    def put(self, username: str, session: Any) -> None:
+        """Register a user's session, replacing any previous one"""
+        with self.__lock:
+            self.__sessions.pop(username, None)
+            self.__sessions[username] = (session, time.time())
+            self.__evict()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__sessions)
+
+    def __evict(self) -> None:
+        cutoff = time.time() - self.__idle_ttl
+        excess = len(self.__sessions) - self.__max_size
+        for username, (session, last_used) in list(self.__sessions.items()):
+            if excess <= 0 and last_used > cutoff:
+                break
+            if not session.active:
+                del self.__sessions[username]
+                excess -= 1
+
+
+class UserDirectory(object):
+    """Cache of each user's IM channel id and User row
+
+    A user's cached row must be invalidated whenever it is changed so the next lookup reads it back from the DB.
+    """
+
+    def __init__(self, get_im_channel: Callable[[str], Dict]) -> None:
+        self.__get_im_channel = get_im_channel
+        self.__lock = Lock()
+        self.__channels = {}  # type: Dict[str, str]
+        self.__users = {}  # type: Dict[str, User]
+
+    def channel_id(self, username: str) -> str:
+        """Id of the IM channel between the bot and a user"""
+        with self.__lock:
+            if username in self.__channels:
+                return self.__channels[username]
+        channel_id = self.__get_im_channel(username)["id"]
+        with self.__lock:
+            self.__channels[username] = channel_id
+        return channel_id
+
+    def user(self, username: str) -> User:
+        """User row for a username, created if it does not exist yet"""
+        with self.__lock:
+            if username in self.__users:
+                return self.__users[username]
+        try:
+            rec = User.get(User.username == username)
+        except User.DoesNotExist:
+            rec = User.create(username=username)
+        with self.__lock:
+            self.__users[username] = rec
+        return rec
+
+    def remember(self, user: User, channel_id: str) -> None:
+        """Cache a user's row and IM channel id that were loaded some other way"""
+        with self.__lock:
+            self.__users[user.username] = user
+            self.__channels[user.username] = channel_id
+
+    def invalidate(self, username: str) -> None:
+        """Drop a user's cached row"""
+        with self.__lock:
+            self.__users.pop(username, None)
@@ -0,0 +1,83 @@
+from db import *
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+
+def resolve_events(user: User) -> int:
+    """Deactivate every active event of a user in one statement, returning how many were deactivated"""
+    return Event.update(active=False).where((Event.user == user) & (Event.active == True)).execute()
+
+
+def has_active_event(user: User, conflict_type: str, tickets: List[str] = None) -> bool:
+    """Whether a user has an active event of one conflict type, optionally for exactly the given set of tickets"""
+    query = Event.select().where((Event.user == user) & (Event.active == True) &
+                                 (Event.conflict_type == conflict_type))
+    if tickets:
+        query = query.where(Event.tickets_hash == ticket_set_hash(tickets))
+    return query.exists()
+
+
+def store_tickets(event_id: int, tickets: List[str]) -> None:
+    """Record the tickets affected by an event"""
+    Event.update(tickets_hash=ticket_set_hash(tickets)).where(Event.id == event_id).execute()
+    EventTicket.insert_many([{"event": event_id, "ticket_key": key, "position": idx}
+                             for (idx, key) in enumerate(tickets)]).execute()
+
+
+def open_event(user: User, conflict_type: str, tickets: List[str] = None) -> Event:
+    """Replace a user's active events with a new one"""
+    with db.atomic():
+        resolve_events(user)
+        event = Event.create(conflict_type=conflict_type, user=user)
+        if tickets:
+            store_tickets(event.id, tickets)
+            event.tickets_hash = ticket_set_hash(tickets)
+    return event
+
+
+def set_prev_ticket(user: User, ticket_key: str) -> None:
+    """Remember the ticket a user last worked on"""
+    with db.atomic():
+        if not PrevTicket.update(ticket_key=ticket_key).where(PrevTicket.user == user).execute():
+            PrevTicket.create(user=user, ticket_key=ticket_key)
+
+
+def store_summaries(event_id: int, summaries: Dict[str, str]) -> None:
+    """Record the summaries of an event's tickets as they were shown to the user"""
+    with db.atomic():
+        for (key, summary) in summaries.items():
+            EventTicket.update(summary=summary).where((EventTicket.event == event_id) &
+                                                      (EventTicket.ticket_key == key)).execute()
+
+
+def save_conversation(event: Event, channel_id: str, prompt: str, prev_ticket: Optional[str],
+                      timeout: float) -> Conversation:
+    """Record a prompt about an event that the user has timeout seconds to reply to"""
+    return Conversation.create(event=event, channel_id=channel_id, prompt=prompt, prev_ticket=prev_ticket,
+                               expires=datetime.utcnow() + timedelta(seconds=timeout))
+
+
+def extend_conversation(conversation: Conversation, timeout: float) -> None:
+    """Give the user another timeout seconds to reply"""
+    conversation.expires = datetime.utcnow() + timedelta(seconds=timeout)
+    conversation.save()
+
+
+def close_conversation(conversation: Conversation) -> None:
+    conversation.delete_instance()
+
+
+def open_conversations(usernames: List[str] = None) -> List[Conversation]:
+    """Every conversation still waiting on a reply about an unresolved event, with its event and user, in one query
+
+    Conversations that are over are deleted first.
+    """
+    now = datetime.utcnow()
+    Conversation.delete().where((Conversation.expires <= now) |
+                                (Conversation.event << Event.select(Event.id).where(Event.active == False))) \
+        .execute()
+    query = Conversation.select(Conversation, Event, User).join(Event).join(User) \
+        .where((Event.active == True) & (Conversation.expires > now))
+    if usernames is not None:
+        query = query.where(User.username << usernames)
+    return list(query)
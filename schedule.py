@@ -0,0 +1,134 @@
+from db import User
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+import heapq
+import itertools
+from typing import Dict, List, Tuple
+
+LUNCH = "lunch"
+WORK = "work"
+OFF = "off"
+# the hour either side of starting and stopping work, nothing is checked then
+GRACE = "grace"
+
+GRACE_PERIOD = timedelta(hours=1)
+
+# (on_time, off_time, lunch_on, lunch_off)
+Hours = Tuple[time, time, time, time]
+
+
+def hours_of(user: User) -> Hours:
+    return user.on_time, user.off_time, user.lunch_on, user.lunch_off
+
+
+def day_times(hours: Hours, day: date, tz) -> List[datetime]:
+    """A user's start, stop, lunch start and lunch stop times on the given day"""
+    return [tz.localize(datetime.combine(day, t)) for t in hours]
+
+
+def phase(hours: Hours, now: datetime, tz) -> str:
+    """Which part of their day a user is in"""
+    start_time, off_time, lunch_start_time, lunch_stop_time = day_times(hours, now.date(), tz)
+    if lunch_start_time <= now <= lunch_stop_time:
+        return LUNCH
+    if (start_time + GRACE_PERIOD) <= now <= (off_time - GRACE_PERIOD):
+        return WORK
+    if not ((start_time - GRACE_PERIOD) <= now <= (off_time + GRACE_PERIOD)):
+        return OFF
+    return GRACE
+
+
+def boundaries(hours: Hours, day: date, tz) -> List[datetime]:
+    """Every time on the given day at which a user's phase can change, in order"""
+    start_time, off_time, lunch_start_time, lunch_stop_time = day_times(hours, day, tz)
+    return sorted([start_time - GRACE_PERIOD, start_time + GRACE_PERIOD, off_time - GRACE_PERIOD,
+                   off_time + GRACE_PERIOD, lunch_start_time, lunch_stop_time])
+
+
+class ScheduleIndex(object):
+    """Active users ordered by when they next need checking
+
+    A user is due again after near_interval seconds while within window seconds of a phase boundary, and after
+    idle_interval seconds otherwise.  Users in a grace period are not due until it ends, and nobody is checked later
+    than their next boundary.  A user's hours are read back from the DB after they are invalidated, and everybody's are
+    reread every rebuild_interval seconds.
+    """
+
+    def __init__(self, tz, near_interval: float, idle_interval: float, window: float,
+                 rebuild_interval: float) -> None:
+        self.__tz = tz
+        self.__near = timedelta(seconds=near_interval)
+        self.__idle = timedelta(seconds=idle_interval)
+        self.__window = timedelta(seconds=window)
+        self.__rebuild_interval = timedelta(seconds=rebuild_interval)
+        self.__lock = Lock()
+        self.__hours = {}  # type: Dict[str, Hours]
+        self.__due = {}  # type: Dict[str, datetime]
+        self.__heap = []  # type: List[Tuple[datetime, int, str]]
+        self.__seq = itertools.count()
+        self.__dirty = set()  # type: set
+        self.__last_rebuild = None  # type: datetime
+
+    def usernames(self) -> List[str]:
+        """Every active user in the index"""
+        with self.__lock:
+            return list(self.__hours)
+
+    def invalidate(self, username: str) -> None:
+        """Reread a user's hours and check them on the next tick"""
+        with self.__lock:
+            self.__dirty.add(username)
+
+    def due(self, now: datetime) -> List[str]:
+        """Users due for a check at now, each is rescheduled as it is returned"""
+        with self.__lock:
+            self.__reload(now)
+            due = []
+            while self.__heap and self.__heap[0][0] <= now:
+                when, _, username = heapq.heappop(self.__heap)
+                if self.__due.get(username) != when:
+                    continue
+                due.append(username)
+                self.__push(username, self.__next_check(self.__hours[username], now))
+            return due
+
+    def __push(self, username: str, when: datetime) -> None:
+        self.__due[username] = when
+        heapq.heappush(self.__heap, (when, next(self.__seq), username))
+
+    def __reload(self, now: datetime) -> None:
+        """Reread the hours of invalidated users, or of everybody if a rebuild is due"""
+        rebuild = self.__last_rebuild is None or now - self.__last_rebuild >= self.__rebuild_interval
+        if rebuild:
+            self.__last_rebuild = now
+            stale = set(self.__hours)
+            query = User.select().where(User.active == True)
+        elif self.__dirty:
+            stale = self.__dirty
+            query = User.select().where((User.active == True) & (User.username << list(self.__dirty)))
+        else:
+            return
+        self.__dirty = set()
+        fresh = {u.username: hours_of(u) for u in query}
+        for username in stale - set(fresh):
+            self.__hours.pop(username, None)
+            self.__due.pop(username, None)
+        # on a rebuild, users whose hours are unchanged keep their place in the schedule
+        for (username, hours) in fresh.items():
+            if not rebuild or self.__hours.get(username) != hours:
+                self.__hours[username] = hours
+                self.__push(username, now)
+
+    def __next_check(self, hours: Hours, now: datetime) -> datetime:
+        """When a user checked at now should next be checked"""
+        day = now.date()
+        past = [b for b in boundaries(hours, day, self.__tz) if b <= now]
+        upcoming = [b for b in boundaries(hours, day, self.__tz) if b > now]
+        while not upcoming:
+            day += timedelta(days=1)
+            upcoming = boundaries(hours, day, self.__tz)
+        if phase(hours, now, self.__tz) == GRACE:
+            # grace periods include their end, so wait until just after it
+            return upcoming[0] + timedelta(seconds=1)
+        near = upcoming[0] - now <= self.__window or (past and now - past[-1] <= self.__window)
+        return min(now + (self.__near if near else self.__idle), upcoming[0])
@@ -0,0 +1,118 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event, Lock, Thread
+import logging
+import time
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class SweepScheduler(object):
+    """Run a periodic sweep on a bounded worker pool
+
+    Every interval the plan callable is asked for the sweep's jobs.  Jobs are handed to the pool spread evenly over
+    the first spread seconds of the interval, so at most max_workers of them ever run at once.  A tick that arrives
+    while jobs from the previous sweep are still pending is skipped rather than stacked on top of it.  Once every job
+    of a sweep has finished, on_sweep is called with the seconds since its tick, which include the spread, the number
+    of jobs and the seconds its jobs spent running added up.  on_job is called with the seconds each job, including
+    one-off ones, spent running.
+    """
+
+    def __init__(self, interval: float, plan: Callable[[], List[Callable[[], None]]], max_workers: int,
+                 spread: float = 0.0, on_sweep: Callable[[float, int, float], None] = None,
+                 on_job: Callable[[float], None] = None) -> None:
+        self.__interval = interval
+        self.__plan = plan
+        self.__spread = min(spread, interval)
+        self.__on_sweep = on_sweep
+        self.__on_job = on_job
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.__stop = Event()
+        self.__lock = Lock()
+        self.__pending = []  # type: List[Future]
+        self.__thread = None  # type: Thread
+
+    def start(self, delay: float = 0.0) -> None:
+        """Start ticking, the first sweep runs after delay seconds"""
+        self.__thread = Thread(target=self.__run, args=(time.time() + delay,))
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stop ticking and drop any jobs that have not started yet"""
+        self.__stop.set()
+        self.__pool.shutdown(wait=False)
+
+    def submit(self, job: Callable[[], None]) -> Future:
+        """Run a one-off job on the sweep pool"""
+        return self.__pool.submit(self.__guard, job)
+
+    @property
+    def running(self) -> bool:
+        with self.__lock:
+            return any(not f.done() for f in self.__pending)
+
+    def __run(self, next_tick: float) -> None:
+        """Wait for each tick and dispatch its sweep"""
+        while not self.__stop.wait(max(0.0, next_tick - time.time())):
+            started = next_tick
+            # drop ticks we slept through instead of firing them back to back
+            while next_tick <= time.time():
+                next_tick += self.__interval
+            if self.running:
+                logger.warning("Previous sweep still running, skipping tick")
+                continue
+            try:
+                jobs = self.__plan()
+            except Exception:
+                logger.exception("Failed to plan sweep")
+                continue
+            self.__dispatch(started, jobs)
+
+    def __dispatch(self, started: float, jobs: List[Callable[[], None]]) -> None:
+        """Hand jobs to the pool, spaced evenly across the spread window"""
+        with self.__lock:
+            self.__pending = []
+        if not jobs:
+            self.__finished(started, 0, 0.0)
+        remaining = [len(jobs)]
+        busy = [0.0]
+
+        def done(future: Future) -> None:
+            with self.__lock:
+                remaining[0] -= 1
+                busy[0] += future.result()
+                last = remaining[0] == 0
+            if last:
+                self.__finished(started, len(jobs), busy[0])
+
+        for idx, job in enumerate(jobs):
+            offset = started + self.__spread * idx / len(jobs)
+            if self.__stop.wait(max(0.0, offset - time.time())):
+                return
+            future = self.__pool.submit(self.__guard, job)
+            with self.__lock:
+                self.__pending.append(future)
+            future.add_done_callback(done)
+
+    def __finished(self, started: float, jobs: int, busy: float) -> None:
+        if self.__on_sweep:
+            try:
+                self.__on_sweep(time.time() - started, jobs, busy)
+            except Exception:
+                logger.exception("Sweep callback failed")
+
+    def __guard(self, job: Callable[[], None]) -> float:
+        """Keep one failing job from being silently swallowed by its future, returning how long it ran"""
+        started = time.perf_counter()
+        try:
+            job()
+        except Exception:
+            logger.exception("Sweep job failed")
+        seconds = time.perf_counter() - started
+        if self.__on_job:
+            try:
+                self.__on_job(seconds)
+            except Exception:
+                logger.exception("Sweep job callback failed")
+        return seconds
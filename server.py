@@ -1,80 +1,145 @@
-from jira import JIRA
 from slacksocket import SlackSocket
-from threading import Thread, Timer
-import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from db import *
-import re
 from datetime import time, datetime, timedelta
+import logging
 import sys
+import threading
 from pytz import timezone
 import config
-from typing import Dict
-
-slack_sock = SlackSocket(config.slack_token, True, ["message"])
-active_sessions = {}  # type: Dict[str, Session]
-jira_conn = JIRA(server=config.jira_server, basic_auth=(config.jira_user, config.jira_pass))
-check_timer = None  # type: Timer
+from typing import Callable, List, Optional
+from tickets import TicketCache, chunked, fetch_in_progress, search
+from commands import build_routers, parse_hours
+from scheduler import SweepScheduler
+from schedule import LUNCH, OFF, WORK, ScheduleIndex, hours_of, phase
+from dispatcher import Dispatcher
+from outbox import Outbox
+from registry import SessionRegistry, UserDirectory
+from repository import has_active_event, open_event, resolve_events, set_prev_ticket
+from repository import close_conversation, extend_conversation, open_conversations, save_conversation, store_summaries
+from webhook import WebhookListener
+from sharding import LeaseManager
+from stats import WorkLog, prune, team_stats, user_stats
+from jira_client import CircuitBreaker, CircuitOpen, JiraClient, connect
+from lazy import Lazy
+from metrics import Gauge, Instrumented, MetricsServer
+import metrics
+from transitions import TRANSITION_FIELDS, Transitioner, describe_failures
+
+logger = logging.getLogger(__name__)
+
+# times a user is checked before giving up on them for this sweep when the DB stays locked
+CHECK_ATTEMPTS = 3
+
+# nothing below talks to Slack or JIRA until it is first used, main() warms both connections up together
+slack_sock = Lazy(lambda: SlackSocket(config.slack_token, True, ["message"]))
+# every Slack and JIRA call other than reading events goes through these, so they are counted and timed
+slack_api = Instrumented(slack_sock, metrics.slack_calls, metrics.slack_seconds)
+active_sessions = SessionRegistry(getattr(config, "max_sessions", 1000), getattr(config, "session_idle_ttl", 3600))
+directory = UserDirectory(lambda username: slack_api.get_im_channel(username))
+jira_session = Lazy(lambda: connect(config.jira_server, (config.jira_user, config.jira_pass),
+                                    getattr(config, "jira_pool_size", 16), getattr(config, "jira_timeout", 30)))
+jira_conn = JiraClient(Instrumented(jira_session, metrics.jira_calls, metrics.jira_seconds),
+                       getattr(config, "jira_retries", 3), getattr(config, "jira_backoff", 1.0),
+                       CircuitBreaker(getattr(config, "jira_failure_threshold", 5),
+                                      getattr(config, "jira_reset_timeout", 60)))
+transitioner = Transitioner(jira_conn, getattr(config, "transition_ttl", 3600),
+                            getattr(config, "transition_workers", 6))
+schedule_index = ScheduleIndex(timezone(config.time_zone), getattr(config, "sweep_interval", 300),
+                               getattr(config, "idle_poll_interval", 900), getattr(config, "boundary_window", 900),
+                               getattr(config, "resync_interval", 3600))
+outbox = Outbox(lambda channel_id, text: slack_api.send_msg(text, channel_id=channel_id, confirm=False),
+                getattr(config, "slack_rate", 1.0), getattr(config, "slack_burst", 3),
+                getattr(config, "slack_retries", 5), getattr(config, "slack_backoff", 1.0))
+# a check is credited with at most the longest a user can go between checks
+work_log = WorkLog(getattr(config, "idle_poll_interval", 900) + getattr(config, "sweep_interval", 300))
+dispatcher = Dispatcher(getattr(config, "session_workers", 4), getattr(config, "conversation_timeout", 1800))
+sweep_scheduler = None  # type: SweepScheduler
+ticket_cache = None  # type: TicketCache
+webhook_listener = None  # type: WebhookListener
+metrics_server = None  # type: MetricsServer
+leases = None  # type: LeaseManager
+next_prune = None  # type: datetime
+
+metrics.REGISTRY.register(Gauge("nagbot_sessions", "Sessions held in memory", lambda: len(active_sessions)))
+metrics.REGISTRY.register(Gauge("nagbot_sessions_waiting", "Sessions waiting on a reply from their user",
+                                lambda: dispatcher.pending))
+metrics.REGISTRY.register(Gauge("nagbot_session_messages_queued", "Messages waiting to be handled by a session",
+                                lambda: dispatcher.queued))
+metrics.REGISTRY.register(Gauge("nagbot_outbox_depth", "Messages waiting to be posted to Slack",
+                                lambda: outbox.depth))
+metrics.REGISTRY.register(Gauge("nagbot_jira_healthy", "1 while JIRA calls are let through, 0 while paused",
+                                lambda: int(jira_conn.healthy)))
+metrics.REGISTRY.register(Gauge("nagbot_users_owned", "Users this instance holds the lease of",
+                                lambda: len(leases.owned()) if leases else 0))
+metrics.REGISTRY.register(Gauge("nagbot_threads", "Live threads", threading.active_count))
 
 
 # TODO: Should possibly refactor
 # TODO: Everything here should use slack buttons
 class Session(object):
-    def __init__(self, username: str, context: Event = None) -> None:
-        self.__queue = queue.Queue()
-        channel = slack_sock.get_im_channel(username)
-        self.__channel_id = channel["id"]
-        try:
-            rec = User.get(User.username == username)
-        except User.DoesNotExist:
-            rec = User.create(username=username)
-        self.__user = rec
-        self.active = False
+    def __init__(self, username: str, context: Event = None, conversation: Conversation = None) -> None:
+        self.__channel_id = directory.channel_id(username)
+        self.__user = directory.user(username)
+        self.active = True
         self.__context = context
         self.__prev_ticket = None  # type: PrevTicket
+        self.__conversation = conversation
 
+        if conversation:
+            # picked back up after a restart, the prompt has already been sent
+            self.__prev_ticket = conversation.prev_ticket
         # this should happen elsewhere
-        if context:
-            self.active = True
+        elif context:
             if context.conflict_type == "on_over":
-                ticket_dict = {t.key: t for t in jira_conn.search_issues("key in ({0})"
-                                                                         .format(",".join(context.tickets_affected)))}
-
-                self.__send_message("\n".join(["You have two or more tickets in progress, which are you currently "
-                                               "working on?"] +
-                                              ["[{0}] - {1} -- {2}".format(idx + 1, t, ticket_dict[t].fields.summary)
-                                               for (idx, t) in enumerate(context.tickets_affected)]))
+                ticket_dict = {t.key: t for t in search(jira_conn, "key in ({0})"
+                                                        .format(",".join(context.tickets_affected)), "summary")}
+                summaries = {k: ticket_dict[k].fields.summary for k in context.tickets_affected}
+                prompt = "\n".join(["You have two or more tickets in progress, which are you currently working on?"] +
+                                   ["[{0}] - {1} -- {2}".format(idx + 1, t, summaries[t])
+                                    for (idx, t) in enumerate(context.tickets_affected)])
+                store_summaries(context.id, summaries)
             elif context.conflict_type == "on_under":
                 if self.__user.prev_tickets.count():
                     self.__prev_ticket = self.__user.prev_tickets[0].ticket_key
-                    ticket = jira_conn.issue(self.__prev_ticket)
-                    self.__send_message("You have no tickets in progress.\n"
-                                        "If you want move {0} - {1} to 'In Progress' reply with 'yes'.\n"
-                                        "Reply with 'no' to dismiss this message.".format(self.__prev_ticket,
-                                                                                          ticket.fields.summary))
+                    ticket = jira_conn.issue(self.__prev_ticket, fields="summary")
+                    prompt = "You have no tickets in progress.\n" \
+                             "If you want move {0} - {1} to 'In Progress' reply with 'yes'.\n" \
+                             "Reply with 'no' to dismiss this message.".format(self.__prev_ticket,
+                                                                               ticket.fields.summary)
                 else:
-                    self.__send_message("You have no tickets 'In Progress'.\n"
-                                        "Reply with 'resolve' to dismiss this message.")
-
-            elif context.conflict_type == "off_over":
-                self.__send_message("You have one or more tickets 'In Progress'.\n"
-                                    "If you would like to move them to 'On Hold', reply with 'yes'.\n"
-                                    "Reply with 'no' to dismiss this message")
-
-    def queue_message(self, message: str) -> None:
-        """Queue a message for processing"""
-        self.__queue.put(message)
+                    prompt = "You have no tickets 'In Progress'.\n" \
+                             "Reply with 'resolve' to dismiss this message."
 
-    def start_worker(self) -> None:
-        """Start worker thread"""
-        self.active = True
-        t = Thread(target=self.__process_message)
-        t.daemon = True
-        t.start()
+            else:
+                prompt = "You have one or more tickets 'In Progress'.\n" \
+                         "If you would like to move them to 'On Hold', reply with 'yes'.\n" \
+                         "Reply with 'no' to dismiss this message"
+            self.__conversation = save_conversation(context, self.__channel_id, prompt, self.__prev_ticket,
+                                                    getattr(config, "conversation_timeout", 1800))
+            self.__send_message(prompt)
+
+    @property
+    def expires(self) -> Optional[float]:
+        """When the user's time to reply runs out, as a timestamp"""
+        if not self.__conversation:
+            return None
+        return (self.__conversation.expires - datetime(1970, 1, 1)).total_seconds()
+
+    def __update_conversation(self) -> None:
+        """Keep the saved conversation in step with the session, forgetting it once the session is over"""
+        if not self.__conversation:
+            return
+        if self.active:
+            extend_conversation(self.__conversation, getattr(config, "conversation_timeout", 1800))
+        else:
+            close_conversation(self.__conversation)
+            self.__conversation = None
 
-    def __process_message(self) -> None:
-        """Block for message then dispatch it to the proper method"""
+    def handle(self, message: str) -> None:
+        """Dispatch a message to the proper method, the session stays active while its event is unresolved"""
         try:
-            message = self.__queue.get(True, 1800)
             if message == "activate":
                 self.__activate_user()
 
@@ -85,124 +150,106 @@ class Session(object):
                                     " reply with 'help'.")
             message = message.lower()
             self.__lookup_action(message)
-            if self.__context and self.__context.active:
-                self.__process_message()
-
-        except queue.Empty:
-            if self.__context and self.__context.active:
-                slack_sock.send_msg("Time's up, you'll need to resolve this event via JIRA.",
-                                    channel_id=self.__channel_id)
+        except CircuitOpen:
+            self.__send_message("JIRA is unavailable right now, please try again in a few minutes.")
         finally:
-            self.active = False
+            self.active = bool(self.__context and self.__context.active)
+            self.__update_conversation()
+
+    def expire(self) -> None:
+        """Close the conversation once the user has gone 30 minutes without replying"""
+        unresolved = bool(self.__context and self.__context.active)
+        metrics.sessions_expired.inc(unresolved=str(unresolved).lower())
+        if unresolved:
+            self.__send_message("Time's up, you'll need to resolve this event via JIRA.")
+        self.active = False
+        self.__update_conversation()
 
     def __activate_user(self) -> None:
         """Activate the user associated with this session"""
         self.__user.active = True
         self.__user.save()
+        directory.invalidate(self.__user.username)
+        schedule_index.invalidate(self.__user.username)
         self.__send_message("User activated")
 
     def __lookup_action(self, message: str) -> None:
         """Parse a message and dispatch to the proper method"""
+        self.__routers[self.__context.conflict_type if self.__context else None].dispatch(self, message)
+
+    def __choose_ticket(self, choice: int) -> None:
+        """Put every ticket other than the chosen one on hold"""
+        chosen = None
+        others = []
+        for idx, t_key in enumerate(self.__context.tickets_affected):
+            if idx == choice - 1:
+                chosen = t_key
+            else:
+                others.append(t_key)
+        results = transitioner.transition_keys(others, "Halt Work")
+        self.__send_message("\n".join(describe_failures(results, "On Hold")) or
+                            "All 'In Progress' tickets other than {0} have been set to 'On Hold'.".format(chosen))
+        self.__context.active = False
+        self.__context.save()
 
-        # TODO: Should do this better
-        if self.__context:
-            if self.__context.conflict_type == "on_over":
-                if re.search("^\d+$", message):
-                    chosen = None
-                    for idx, t_key in enumerate(self.__context.tickets_affected):
-                        if idx == int(message) - 1:
-                            chosen = t_key
-                        else:
-                            ticket = jira_conn.issue(t_key)
-                            transition = jira_conn.find_transitionid_by_name(ticket, "Halt Work")
-                            jira_conn.transition_issue(ticket, transition)
-                    self.__send_message("All 'In Progress' tickets other than {0} have been set to 'On Hold'."
-                                        .format(chosen))
-                    self.__context.active = False
-                    self.__context.save()
-            elif self.__context.conflict_type == "on_under":
-                if message == "yes" and self.__prev_ticket:
-                    ticket = jira_conn.issue(self.__prev_ticket)
-                    transition = jira_conn.find_transitionid_by_name(ticket, "Resume Work")
-                    self.__send_message("{0} has been set to 'In Progress'.".format(self.__prev_ticket))
-                    jira_conn.transition_issue(ticket, transition)
-                elif message == "no" or message == "resolve":
-                    self.__send_message("Event resolved.")
-                    self.__context.active = False
-                    self.__context.save()
-            elif self.__context.conflict_type == "off_over":
-                if message == "yes":
-                    for t_key in self.__context.tickets_affected:
-                        ticket = jira_conn.issue(t_key)
-                        transition = jira_conn.find_transitionid_by_name(ticket, "Halt Work")
-                        jira_conn.transition_issue(ticket, transition)
-                    self.__send_message("All 'In Progress' tickets have been set to 'On Hold'.")
-                    self.__context.active = False
-                    self.__context.save()
-                elif message == "no":
-                    self.__send_message("Event resolved.")
-                    self.__context.active = False
-                    self.__context.save()
-
-        # help check
-        if message == "help":
-            self.__show_help()
-
-        # inactivate check
-        elif message == "inactivate":
-            self.__inactivate_user()
-
-        # pause check
-        elif message == "pause":
-            self.__pause_ticket()
-
-        # resume check
-        elif message == "resume":
-            self.__resume_ticket()
-
-        # get hours check
-        elif re.search("^(?:get|show) (?:hours|options|settings)$", message):
-            self.__show_opts()
-
-        # get team check
-        elif re.search("^(?:get|show) (?:people|team)$", message):
-            self.__show_people()
-
-        # set hours check
-        match = re.search("^set hours (\d{1,2})(?::(\d{1,2}))? ?(am|pm)? ?- ?(\d+)(?::(\d{1,2}))? ?(am|pm)?$", message)
-        if match:
-            self.__set_hours(time(hour=int(match.group(1)) if match.group(3) != "pm" else int(match.group(1)) + 12,
-                                  minute=int(match.group(2)) if match.group(2) else 0),
-                             time(hour=int(match.group(4)) + 12 if match.group(6) != "am" else int(match.group(4)),
-                                  minute=int(match.group(5)) if match.group(5) else 0))
-
-        # set lunch hours check
-        match = re.search("^set lunch hours (\d{1,2})(?::(\d{1,2}))? ?(am|pm)? ?- ?(\d+)(?::(\d{1,2}))? ?(am|pm)?$",
-                          message)
-        if match:
-            self.__set_lunch_hours(time(hour=int(match.group(1)) if match.group(3) != "pm"
-                                        else int(match.group(1)) + 12,
-                                        minute=int(match.group(2)) if match.group(2) else 0),
-                                   time(hour=int(match.group(4)) + 12 if match.group(6) != "am"
-                                        else int(match.group(4)),
-                                        minute=int(match.group(5)) if match.group(5) else 0))
+    def __resume_prev_ticket(self) -> None:
+        """Move the suggested previous ticket back to 'In Progress'"""
+        if self.__prev_ticket:
+            results = transitioner.transition_keys([self.__prev_ticket], "Resume Work")
+            self.__send_message("\n".join(describe_failures(results, "In Progress")) or
+                                "{0} has been set to 'In Progress'.".format(self.__prev_ticket))
+
+    def __halt_all(self) -> None:
+        """Put every ticket affected by the event on hold"""
+        results = transitioner.transition_keys(self.__context.tickets_affected, "Halt Work")
+        self.__send_message("\n".join(describe_failures(results, "On Hold")) or
+                            "All 'In Progress' tickets have been set to 'On Hold'.")
+        self.__context.active = False
+        self.__context.save()
+
+    def __dismiss(self) -> None:
+        """Resolve the event without touching any tickets"""
+        self.__send_message("Event resolved.")
+        self.__context.active = False
+        self.__context.save()
+
+    __routers = build_routers({
+        "help": lambda s, m: s.__show_help(),
+        "inactivate": lambda s, m: s.__inactivate_user(),
+        "pause": lambda s, m: s.__pause_ticket(),
+        "resume": lambda s, m: s.__resume_ticket(),
+        "show_opts": lambda s, m: s.__show_opts(),
+        "show_people": lambda s, m: s.__show_people(),
+        "show_stats": lambda s, m: s.__show_stats(),
+        "show_team_stats": lambda s, m: s.__show_team_stats(),
+        "set_hours": lambda s, m: s.__set_hours(*parse_hours(m)),
+        "set_lunch_hours": lambda s, m: s.__set_lunch_hours(*parse_hours(m)),
+        "choose_ticket": lambda s, m: s.__choose_ticket(int(m.group(0))),
+        "resume_prev": lambda s, m: s.__resume_prev_ticket(),
+        "halt_all": lambda s, m: s.__halt_all(),
+        "dismiss": lambda s, m: s.__dismiss(),
+    })
 
     def __set_hours(self, start: time, end: time) -> None:
         """Set working hours"""
         self.__user.on_time = start
         self.__user.off_time = end
         self.__user.save()
+        directory.invalidate(self.__user.username)
+        schedule_index.invalidate(self.__user.username)
         self.__send_message("Hours set")
 
     def __inactivate_user(self) -> None:
         """Inactivate the user assoc"""
         self.__user.active = False
         self.__user.save()
+        directory.invalidate(self.__user.username)
+        schedule_index.invalidate(self.__user.username)
         self.__send_message("User deactivated")
 
     def __send_message(self, message: str) -> None:
-        """Send a pm to the user associated with this session"""
-        slack_sock.send_msg(message, channel_id=self.__channel_id, confirm=False)
+        """Queue a pm to the user associated with this session"""
+        outbox.send(self.__channel_id, message)
 
     def __show_opts(self) -> None:
         """Show the user's selected options"""
@@ -258,6 +305,8 @@ class Session(object):
                                 "pause -- set current case(s) to 'On Hold'\n"
                                 "resume -- set last case to 'In Progress'\n"
                                 "get team -- show the people in your team\n"
+                                "get stats -- show how your time was spent today and this week\n"
+                                "get team stats -- show how everyone's time was spent today\n"
                                 "Wondering about another part of this bot?  'help' changes depending on the context")
 
     def __set_lunch_hours(self, start: time, end: time) -> None:
@@ -265,22 +314,19 @@ class Session(object):
         self.__user.lunch_on = start
         self.__user.lunch_off = end
         self.__user.save()
+        directory.invalidate(self.__user.username)
+        schedule_index.invalidate(self.__user.username)
         self.__send_message("Lunch hours set")
 
     def __pause_ticket(self) -> None:
-        in_progress = jira_conn.search_issues("project={0} and assignee={1} and status=\"In Progress\""
-                                              .format(config.jira_project, self.__user.username))
-        for ticket in in_progress:
-            transition = jira_conn.find_transitionid_by_name(ticket, "Halt Work")
-            jira_conn.transition_issue(ticket, transition)
-        if in_progress.total > 0:
-            if self.__user.prev_tickets.count():
-                prev_ticket = self.__user.prev_tickets  # type: PrevTicket
-                prev_ticket.ticket_key = in_progress[0].key
-                prev_ticket.save()
-            else:
-                PrevTicket.create(user=self.__user, ticket_key=in_progress[0].key)
-            if in_progress.total == 1:
+        in_progress = list(search(jira_conn, "project={0} and assignee={1} and status=\"In Progress\""
+                                  .format(config.jira_project, self.__user.username), TRANSITION_FIELDS))
+        failures = describe_failures(transitioner.transition(in_progress, "Halt Work"), "On Hold")
+        if in_progress:
+            set_prev_ticket(self.__user, in_progress[0].key)
+            if failures:
+                self.__send_message("\n".join(failures))
+            elif len(in_progress) == 1:
                 self.__send_message("{0} has been set to 'On Hold'.".format(in_progress[0].key))
             else:
                 self.__send_message("All tickets have been set to 'On Hold'.")
@@ -290,19 +336,16 @@ class Session(object):
         self.__resolve_all()
 
     def __resume_ticket(self) -> None:
-        in_progress = jira_conn.search_issues("project={0} and assignee={1} and status=\"In Progress\""
-                                              .format(config.jira_project, self.__user.username))
-        for ticket in in_progress:
-            transition = jira_conn.find_transitionid_by_name(ticket, "Halt Work")
-            jira_conn.transition_issue(ticket, transition)
+        in_progress = list(search(jira_conn, "project={0} and assignee={1} and status=\"In Progress\""
+                                  .format(config.jira_project, self.__user.username), TRANSITION_FIELDS))
+        failures = describe_failures(transitioner.transition(in_progress, "Halt Work"), "On Hold")
 
         self.__resolve_all()
 
         if self.__user.prev_tickets.count():
-            ticket = jira_conn.issue(self.__user.prev_tickets[0].ticket_key)
-            transition = jira_conn.find_transitionid_by_name(ticket, "Resume Work")
-            jira_conn.transition_issue(ticket, transition)
-            self.__send_message("{0} has been set to 'In Progress'.".format(ticket.key))
+            key = self.__user.prev_tickets[0].ticket_key
+            failures += describe_failures(transitioner.transition_keys([key], "Resume Work"), "In Progress")
+            self.__send_message("\n".join(failures) or "{0} has been set to 'In Progress'.".format(key))
         else:
             self.__send_message("You have no previous ticket.")
 
@@ -313,138 +356,264 @@ class Session(object):
                                                          u.off_time.strftime("%I:%M %p")))
         self.__send_message("\n".join(buffer_list))
 
+    def __show_stats(self) -> None:
+        self.__send_message(user_stats(self.__user, datetime.now(timezone(config.time_zone))))
+
+    def __show_team_stats(self) -> None:
+        self.__send_message(team_stats(datetime.now(timezone(config.time_zone))))
+
     def resolve_event(self) -> None:
         self.__context.active = False
         self.__context.save()
         self.active = False
 
     def __resolve_all(self) -> None:
-        for e in self.__user.events.where(Event.active == True):
-            e.active = False
-            e.save()
-
-
-def check_active_tickets() -> None:
-    global check_timer
-    check_timer = Timer(300, check_active_tickets, ())
-    check_timer.start()
-    if datetime.now(timezone(config.time_zone)).weekday() == 5 or \
-            datetime.now(timezone(config.time_zone)).weekday() == 6:
+        resolve_events(self.__user)
+
+
+def check_active_tickets() -> List[Callable[[], None]]:
+    """Plan a sweep, one job per chunk of users that are due a check"""
+    now = datetime.now(timezone(config.time_zone))
+    if now.weekday() == 5 or now.weekday() == 6:
+        return []
+    if not jira_conn.healthy:
+        logger.warning("JIRA is unavailable, skipping sweep")
+        return []
+    due = [u for u in schedule_index.due(now) if owns(u)]
+    if ticket_cache:
+        mine = [u for u in schedule_index.usernames() if owns(u)]
+        # users whose tickets changed are checked now rather than whenever they are next due
+        changed = ticket_cache.refresh(mine)
+        due += [u for u in mine if u.lower() in changed and u not in due]
+    jobs = [partial(check_users, chunk, now) for chunk in chunked(due, getattr(config, "sweep_chunk_size", 50))]
+    global next_prune
+    if next_prune is None or now >= next_prune:
+        next_prune = now + timedelta(days=1)
+        jobs.append(partial(prune, now, getattr(config, "sample_retention_days", 14),
+                            getattr(config, "hourly_retention_days", 90)))
+    return jobs
+
+
+def on_issue_changed(key: str, status: Optional[str], assignee: Optional[str]) -> None:
+    """Apply a ticket change pushed by JIRA and check the users it affects straight away"""
+    changed = ticket_cache.apply(key, status, assignee)
+    now = datetime.now(timezone(config.time_zone))
+    if changed and not (now.weekday() == 5 or now.weekday() == 6):
+        sweep_scheduler.submit(partial(check_users, [u for u in schedule_index.usernames()
+                                                     if u.lower() in changed and owns(u)], now))
+
+
+def check_users(usernames: List[str], now: datetime) -> None:
+    """Look up 'In Progress' tickets for a chunk of users and check each of them"""
+    if not jira_conn.healthy:
         return
-    for u in User.select().where(User.active == True):
+    users = list(User.select().where((User.active == True) & (User.username << usernames)))
+    metrics.users_checked.inc(len(users))
+    if ticket_cache:
+        in_progress = {u.username.lower(): ticket_cache.get(u.username) for u in users}
+    else:
         # TODO: Fix for multiple projects
-        in_progress = jira_conn.search_issues("project={0} and assignee={1} and status=\"In Progress\""
-                                              .format(config.jira_project, u.username))
-
-        start_time = datetime.combine(datetime.now(timezone(config.time_zone)).date(), u.on_time)\
-            .replace(tzinfo=timezone(config.time_zone))
-        off_time = datetime.combine(datetime.now(timezone(config.time_zone)).date(), u.off_time)\
-            .replace(tzinfo=timezone(config.time_zone))
-        lunch_start_time = datetime.combine(datetime.now(timezone(config.time_zone)).date(), u.lunch_on)\
-            .replace(tzinfo=timezone(config.time_zone))
-        lunch_stop_time = datetime.combine(datetime.now(timezone(config.time_zone)).date(), u.lunch_off)\
-            .replace(tzinfo=timezone(config.time_zone))
-
-        # check if it's lunchtime
-        if lunch_start_time <= datetime.now(timezone(config.time_zone)) <= lunch_stop_time:
-            if in_progress.total > 1:
-                ticket_keys = [t.key for t in in_progress]
-                if not any(set(e.ticket_list) == set(ticket_keys) for e in
-                           u.events.where((Event.active == True) & (Event.conflict_type == "on_over"))):
-                    for e in u.events.where(Event.active == True):
-                        e.active = False
-                        e.save()
-                    context = Event.create(conflict_type="on_over", user=u)
-                    context.tickets_affected = ticket_keys
-                    context.save()
-                    s = Session(u.username, context)
-                    active_sessions[u.username] = s
-                    s.start_worker()
+        in_progress = fetch_in_progress(jira_conn, config.jira_project, [u.username for u in users])
+    for u in users:
+        # one user failing must not keep the rest of the chunk from being checked
+        for attempt in range(CHECK_ATTEMPTS):
+            try:
+                check_user(u, in_progress[u.username.lower()], now)
+                break
+            except CircuitOpen:
+                raise
+            except OperationalError:
+                if attempt == CHECK_ATTEMPTS - 1:
+                    logger.exception("Failed to check %s", u.username)
+            except Exception:
+                logger.exception("Failed to check %s", u.username)
+                break
+
+
+def check_user(u: User, ticket_keys: List[str], now: datetime) -> None:
+    """Decide whether a user's 'In Progress' tickets conflict with their hours and start a session if so"""
+    # take the write lock up front, a read transaction upgrading to a write fails outright if another thread wrote
+    with db.atomic("IMMEDIATE"):
+        # another instance may have taken the user over since the sweep was planned
+        if leases and not leases.holds(u):
+            return
+        context = decide(u, ticket_keys, now)
+    # kept out of the decision's transaction, losing a sample must not lose the nag with it
+    try:
+        work_log.record(u, phase(hours_of(u), now, timezone(config.time_zone)), ticket_keys, now)
+    except Exception:
+        logger.exception("Failed to record work sample for %s", u.username)
+    if context:
+        try:
+            s = Session(u.username, context)
+        except Exception:
+            # an event the user was never told about would block raising it again, so let a later check raise it
+            try:
+                context.active = False
+                context.save()
+            except Exception:
+                logger.exception("Failed to switch off event %d for %s", context.id, u.username)
+            raise
+        metrics.events_created.inc(conflict_type=context.conflict_type)
+        metrics.sessions_started.inc(origin="sweep")
+        active_sessions.put(u.username, s)
+        dispatcher.watch(s, s.expires)
+
+
+def decide(u: User, ticket_keys: List[str], now: datetime) -> Optional[Event]:
+    """Record the outcome of checking a user, returning the new event if one needs to be raised with them"""
+    user_phase = phase(hours_of(u), now, timezone(config.time_zone))
+
+    if user_phase == LUNCH:
+        if len(ticket_keys) > 1:
+            if not has_active_event(u, "on_over", ticket_keys):
+                return open_event(u, "on_over", ticket_keys)
+
+    # in work hours with one hour of grace
+    elif user_phase == WORK:
+        if len(ticket_keys) > 1:
+            if not has_active_event(u, "on_over", ticket_keys):
+                return open_event(u, "on_over", ticket_keys)
+
+        elif len(ticket_keys) == 0:
+            if not has_active_event(u, "on_under"):
+                return open_event(u, "on_under")
+
+        # recording last worked on ticket for suggestion
         else:
-            # check if in work hours with one hour of grace
-            if (start_time + timedelta(hours=1)) <= datetime.now(timezone(config.time_zone)) <= \
-                    (off_time - timedelta(hours=1)):
-                if in_progress.total > 1:
-                    ticket_keys = [t.key for t in in_progress]
-                    if not any(set(e.tickets_affected) == set(ticket_keys) for e in
-                               u.events.where((Event.active == True) & (Event.conflict_type == "on_over"))):
-                        for e in u.events.where(Event.active == True):
-                            e.active = False
-                            e.save()
-                        context = Event.create(conflict_type="on_over", user=u)
-                        context.tickets_affected = ticket_keys
-                        context.save()
-                        s = Session(u.username, context)
-                        active_sessions[u.username] = s
-                        s.start_worker()
-
-                elif in_progress.total == 0:
-                    if not u.events.where((Event.active == True) & (Event.conflict_type == "on_under")):
-                        for e in u.events.where(Event.active == True):
-                            e.active = False
-                            e.save()
-                        context = Event.create(conflict_type="on_under", user=u)
-                        s = Session(u.username, context)
-                        active_sessions[u.username] = s
-                        s.start_worker()
-
-                # recording last worked on ticket for suggestion
-                else:
-                    if u.prev_tickets.count():
-                        prev_ticket = u.prev_tickets  # type: PrevTicket
-                        prev_ticket.ticket_key = in_progress[0].key
-                        prev_ticket.save()
-                    else:
-                        PrevTicket.create(user=u, ticket_key=in_progress[0].key)
-
-                    for e in u.events.where(Event.active == True):
-                        e.active = False
-                        e.save()
-
-            # check if not in work hours with one hour of grace
-            elif not ((start_time - timedelta(hours=1)) <= datetime.now(timezone(config.time_zone)) <=
-                      (off_time + timedelta(hours=1))):
-                if in_progress.total > 0:
-                    for e in u.events.where(Event.active == True):
-                        e.active = False
-                        e.save()
-                    context = Event(conflict_type="off_over", user=u)
-                    context.tickets_affected = [t.key for t in in_progress]
-                    context.save()
-                    s = Session(u.username, context)
-                    active_sessions[u.username] = s
-                    s.start_worker()
+            set_prev_ticket(u, ticket_keys[0])
+            resolve_events(u)
+
+    # not in work hours with one hour of grace
+    elif user_phase == OFF:
+        if len(ticket_keys) > 0:
+            return open_event(u, "off_over", ticket_keys)
+
+        else:
+            resolve_events(u)
+    return None
+
+
+def owns(username: str) -> bool:
+    """Whether this instance looks after a user, always the case unless sharding is on"""
+    return leases is None or leases.owns(username)
 
-                else:
-                    for e in u.events.where(Event.active == True):
-                        e.active = False
-                        e.save()
+
+def has_open_session(username: str) -> bool:
+    """Whether a user is in the middle of a conversation with this instance"""
+    session = active_sessions.get(username)
+    return bool(session and session.active)
+
+
+def on_users_claimed(usernames: List[str]) -> None:
+    """Check users taken over from another instance on the next tick and pick up their open conversations"""
+    for username in usernames:
+        schedule_index.invalidate(username)
+        # another instance may have changed the user while it held them, saving a stale row would undo that
+        directory.invalidate(username)
+    rehydrate(usernames)
+
+
+def rehydrate(usernames: List[str] = None) -> int:
+    """Pick open conversations back up from the DB without calling JIRA or Slack, returning how many there were"""
+    resumed = 0
+    for c in open_conversations(usernames):
+        user = c.event.user
+        if has_open_session(user.username) or not owns(user.username):
+            continue
+        directory.remember(user, c.channel_id)
+        s = Session(user.username, c.event, c)
+        active_sessions.put(user.username, s)
+        dispatcher.watch(s, s.expires)
+        resumed += 1
+    return resumed
+
+
+def on_sweep(seconds: float, jobs: int, busy: float) -> None:
+    """Record how long a sweep took from its tick, spread included, and how long its jobs actually ran"""
+    metrics.sweep_seconds.observe(seconds)
+    if getattr(config, "log_sweeps", False):
+        logger.info("Sweep of %d jobs finished %.2fs after its tick, its jobs ran for %.2fs in total", jobs, seconds,
+                    busy)
+
+
+def warm_up(pool: ThreadPoolExecutor) -> list:
+    """Start connecting to Slack and JIRA at the same time, returning the futures to wait on"""
+    return [pool.submit(slack_sock.get), pool.submit(jira_session.get)]
 
 
 def main() -> None:
-    next_five = datetime.now()
-    next_five = next_five.replace(minute=(next_five.minute + (5 - (next_five.minute % 5))))
-    global check_timer
-    check_timer = Timer((next_five - datetime.now()).total_seconds(), check_active_tickets, ())
-    check_timer.start()
+    global sweep_scheduler, ticket_cache, webhook_listener, metrics_server, leases
+    pool = ThreadPoolExecutor(max_workers=2)
+    slack_ready, jira_ready = warm_up(pool)
+    pool.shutdown(wait=False)
+    if getattr(config, "log_sweeps", False):
+        logging.basicConfig(level=logging.INFO)
+    metrics_port = getattr(config, "metrics_port", None)
+    if metrics_port:
+        metrics_server = MetricsServer(metrics.REGISTRY, getattr(config, "metrics_host", "127.0.0.1"), metrics_port)
+        metrics_server.start()
+    if getattr(config, "shard_id", None):
+        leases = LeaseManager(config.shard_id, getattr(config, "lease_ttl", 60), on_users_claimed, has_open_session)
+        leases.start()
+    outbox.start()
+    dispatcher.start()
+    logger.info("Resumed %d conversations", rehydrate(leases.owned() if leases else None))
+    webhook_port = getattr(config, "webhook_port", None)
+    if webhook_port or getattr(config, "sweep_mode", "batched") == "incremental":
+        # with webhooks pushing changes in, polling JIRA for them is only needed to catch anything missed
+        ticket_cache = TicketCache(jira_conn, config.jira_project, getattr(config, "sweep_chunk_size", 50),
+                                   getattr(config, "resync_interval", 3600), config.time_zone,
+                                   getattr(config, "reconcile_interval", 1800) if webhook_port else 0)
+    sweep_scheduler = SweepScheduler(getattr(config, "sweep_interval", 300), check_active_tickets,
+                                     getattr(config, "sweep_workers", 4), getattr(config, "sweep_spread", 120),
+                                     on_sweep, metrics.sweep_job_seconds.observe)
+    now = datetime.now()
+    next_five = (now + timedelta(minutes=5 - now.minute % 5)).replace(second=0, microsecond=0)
+    sweep_scheduler.start((next_five - now).total_seconds())
+    if webhook_port:
+        webhook_listener = WebhookListener(getattr(config, "webhook_host", ""), webhook_port,
+                                           getattr(config, "webhook_secret", None), on_issue_changed,
+                                           config.jira_project)
+        webhook_listener.start()
+
+    try:
+        jira_ready.result()
+    except Exception:
+        # JIRA is connected to again on first use, the bot can still answer Slack in the meantime
+        logger.exception("Failed to connect to JIRA")
+    slack_ready.result()
 
     while True:
         event = slack_sock.get_event().event
         if not ("hidden" in event and event["hidden"]) and event["user"] == event["channel"] and \
                 event["user"] != "slackbot":
-            if event["user"] in active_sessions and active_sessions[event["user"]].active:
-                active_sessions[event["user"]].queue_message(event["text"])
-            else:
-                session = Session(event["user"])
-                session.queue_message(event["text"])
-                session.start_worker()
-                active_sessions[event["user"]] = session
+            try:
+                # every instance sees every message, only the one owning the user answers it
+                if not (owns(event["user"]) or leases.claim(event["user"])):
+                    continue
+                session = active_sessions.get(event["user"])
+                if not (session and session.active):
+                    session = Session(event["user"])
+                    metrics.sessions_started.inc(origin="user")
+                    active_sessions.put(event["user"], session)
+                dispatcher.post(session, event["text"])
+            except Exception:
+                # drop the message rather than stop answering everybody else
+                logger.exception("Failed to handle message from %s", event["user"])
+
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
         print("Got Ctrl-C shutting down")
-        if check_timer:
-            check_timer.cancel()
+        if sweep_scheduler:
+            sweep_scheduler.stop()
+        if webhook_listener:
+            webhook_listener.stop()
+        if metrics_server:
+            metrics_server.stop()
+        if leases:
+            leases.stop()
         sys.exit()
@@ -0,0 +1,212 @@
+"""Split users between several bot processes sharing one DB
+
+Every instance heartbeats into the instance table and holds a lease on each user it owns.  Leases are claimed and
+released with conditional updates, so whichever instance's update lands first wins and a user never has two owners.
+An instance stops acting for a user a third of lease_ttl before its lease runs out, and a lease is only up for grabs
+once it has run out, so a stalled or dead instance's users are picked up without anybody being nagged twice.  Clocks
+of the machines running instances are assumed to agree to well within that margin.
+
+Running this module simulates a few instances against a throwaway SQLite DB, killing one of them half way through:
+
+    python sharding.py --instances 3 --users 30 --seconds 20
+"""
+from db import db, Instance, User, UserLease
+from datetime import datetime, timedelta
+from peewee import IntegrityError
+from threading import Event, Lock, Thread
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# long past, the expiry of a lease nobody holds
+NEVER = datetime(1970, 1, 1)
+
+
+class LeaseManager(object):
+    """Claim, renew and give up this instance's share of users
+
+    Every lease_ttl / 3 seconds the instance heartbeats, renews its leases and rebalances: it claims free leases while
+    it owns fewer than its fair share of active users and releases leases while it owns more.  Users for whom busy
+    returns True, e.g. because they are in the middle of a conversation, are not released.  on_claim is called with
+    the usernames of users this instance just took over.
+    """
+
+    def __init__(self, name: str, lease_ttl: float, on_claim: Callable[[List[str]], None] = None,
+                 busy: Callable[[str], bool] = None) -> None:
+        self.name = name
+        self.__ttl = timedelta(seconds=lease_ttl)
+        self.__margin = timedelta(seconds=lease_ttl / 3)
+        self.__on_claim = on_claim
+        self.__busy = busy
+        self.__lock = Lock()
+        self.__owned = {}  # type: Dict[str, datetime]
+        self.__stop = Event()
+
+    def start(self) -> None:
+        """Join the pool of instances and keep up with it on a background thread"""
+        self.tick()
+        t = Thread(target=self.__run)
+        t.daemon = True
+        t.start()
+
+    def stop(self) -> None:
+        """Leave the pool, handing every user back straight away"""
+        self.__stop.set()
+        with self.__lock:
+            self.__owned = {}
+        UserLease.update(owner=None, expires=NEVER).where(UserLease.owner == self.name).execute()
+        Instance.delete().where(Instance.name == self.name).execute()
+
+    def owns(self, username: str) -> bool:
+        """Whether this instance may act for a user right now"""
+        with self.__lock:
+            expires = self.__owned.get(username)
+        return expires is not None and datetime.utcnow() < expires - self.__margin
+
+    def holds(self, user: User) -> bool:
+        """Whether the DB still has this instance holding a user's lease, checked in the transaction acting for them"""
+        return UserLease.select().where((UserLease.user == user) & (UserLease.owner == self.name) &
+                                        (UserLease.expires > datetime.utcnow())).exists()
+
+    def owned(self) -> List[str]:
+        with self.__lock:
+            return list(self.__owned)
+
+    def claim(self, username: str) -> bool:
+        """Take over a user nobody holds, e.g. one messaging the bot for the first time"""
+        if self.owns(username):
+            return True
+        user, _ = User.get_or_create(username=username)
+        self.__ensure_leases([user.id])
+        lease = UserLease.get(UserLease.user == user)
+        if self.__take(lease.id, datetime.utcnow()):
+            self.__renew()
+            if self.__on_claim:
+                self.__on_claim([username])
+            return True
+        return False
+
+    def tick(self) -> None:
+        """Heartbeat, renew and rebalance once"""
+        now = datetime.utcnow()
+        if not Instance.update(heartbeat=now).where(Instance.name == self.name).execute():
+            try:
+                Instance.create(name=self.name, heartbeat=now)
+            except IntegrityError:
+                pass
+        # instances that stopped heartbeating no longer count towards the shares
+        Instance.delete().where(Instance.heartbeat < now - self.__ttl).execute()
+        self.__renew()
+        self.__rebalance(now)
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.__margin.total_seconds()):
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Failed to renew leases")
+
+    def __renew(self) -> None:
+        """Extend every lease this instance holds and reread which users those are"""
+        expires = datetime.utcnow() + self.__ttl
+        UserLease.update(expires=expires).where(UserLease.owner == self.name).execute()
+        owned = {u.username: expires for u in User.select(User.username).join(UserLease)
+                 .where(UserLease.owner == self.name)}
+        with self.__lock:
+            self.__owned = owned
+
+    def __rebalance(self, now: datetime) -> None:
+        active = [u.id for u in User.select(User.id).where(User.active == True)]
+        self.__ensure_leases(active)
+        live = max(1, Instance.select().where(Instance.heartbeat >= now - self.__ttl).count())
+        share = int(math.ceil(len(active) / live))
+        owned = self.owned()
+        if len(owned) > share:
+            spare = [u for u in owned if not (self.__busy and self.__busy(u))][:len(owned) - share]
+            if spare:
+                UserLease.update(owner=None, expires=NEVER) \
+                    .where((UserLease.owner == self.name) &
+                           (UserLease.user << User.select(User.id).where(User.username << spare))).execute()
+                self.__renew()
+        elif len(owned) < share:
+            # read every candidate before claiming any, an open read would keep SQLite from writing
+            free = UserLease.select(UserLease.id) \
+                .where((UserLease.user << User.select(User.id).where(User.active == True)) &
+                       ((UserLease.owner >> None) | (UserLease.expires < now))) \
+                .order_by(UserLease.id).limit(share - len(owned))
+            claimed = [lease.id for lease in list(free) if self.__take(lease.id, now)]
+            if claimed:
+                before = set(owned)
+                self.__renew()
+                if self.__on_claim:
+                    self.__on_claim([u for u in self.owned() if u not in before])
+
+    def __take(self, lease_id: int, now: datetime) -> bool:
+        """Claim a lease if nobody holds it, only one of several instances racing for it succeeds"""
+        return UserLease.update(owner=self.name, expires=now + self.__ttl) \
+            .where((UserLease.id == lease_id) & ((UserLease.owner >> None) | (UserLease.expires < now))) \
+            .execute() == 1
+
+    @staticmethod
+    def __ensure_leases(user_ids: List[int]) -> None:
+        """Create unowned leases for users that have none yet"""
+        existing = {lease.user_id for lease in UserLease.select(UserLease.user)}
+        for user_id in user_ids:
+            if user_id not in existing:
+                try:
+                    with db.atomic():
+                        UserLease.create(user=user_id, owner=None, expires=NEVER)
+                except IntegrityError:
+                    # another instance created it first
+                    pass
+
+
+def _simulate_instance(path: str, name: str, lease_ttl: float) -> None:
+    db.init(path)
+    manager = LeaseManager(name, lease_ttl)
+    manager.start()
+    while True:
+        time.sleep(1)
+
+
+def simulate(instances: int, users: int, seconds: int, lease_ttl: float) -> None:
+    """Run instances as separate processes, printing who owns how many users every second"""
+    path = os.path.join(tempfile.mkdtemp(prefix="nagbot-shards-"), "shards.db")
+    db.init(path)
+    db.create_tables([User, Instance, UserLease])
+    with db.atomic():
+        for n in range(users):
+            User.create(username="user{0}".format(n), active=True)
+    procs = [multiprocessing.Process(target=_simulate_instance, args=(path, "instance{0}".format(n), lease_ttl),
+                                     daemon=True) for n in range(instances)]
+    for p in procs:
+        p.start()
+    for second in range(seconds):
+        if second == seconds // 2:
+            print("killing instance0")
+            procs[0].terminate()
+        time.sleep(1)
+        counts = {}  # type: Dict[str, int]
+        for lease in UserLease.select().where(UserLease.expires > datetime.utcnow()):
+            counts[lease.owner] = counts.get(lease.owner, 0) + 1
+        owners = " ".join("{0}={1}".format(k, v) for (k, v) in sorted(counts.items()))
+        print("{0:3d}s {1} unowned={2}".format(second + 1, owners, users - sum(counts.values())))
+    for p in procs:
+        p.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate sharded instances sharing one SQLite DB")
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--lease-ttl", type=float, default=3.0)
+    args = parser.parse_args()
+    simulate(args.instances, args.users, args.seconds, args.lease_ttl)
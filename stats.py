@@ -0,0 +1,144 @@
+from db import db, User, WorkRollup, WorkSample
+from datetime import datetime, timedelta
+from peewee import IntegrityError, fn
+from schedule import OFF, WORK
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+HOUR = "hour"
+DAY = "day"
+
+
+def period_start(when: datetime, period: str) -> datetime:
+    """Start of the hour or day a local time falls in"""
+    start = when.replace(minute=0, second=0, microsecond=0)
+    return start.replace(hour=0) if period == DAY else start
+
+
+def format_duration(seconds: int) -> str:
+    return "{0}h {1:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+
+
+class WorkLog(object):
+    """Record what every user is working on each time they are checked
+
+    The time between two checks of a user is credited to the phase and the tickets 'In Progress' at the first of them,
+    at most max_gap seconds so time the bot was not running is not counted, split evenly between those tickets.
+    Samples are stamped with the time of that first check, appended to WorkSample and added to the user's hourly and
+    daily WorkRollup totals as they are recorded.  Time with nothing in progress outside work hours is not stored.
+    What a user was doing is only kept in memory, so the first check of each user after a restart credits nothing.
+    """
+
+    def __init__(self, max_gap: float) -> None:
+        self.__max_gap = max_gap
+        self.__lock = Lock()
+        # user id -> (time of their latest check, phase and tickets in progress then)
+        self.__last_seen = {}  # type: Dict[int, Tuple[datetime, str, List[str]]]
+
+    def record(self, user: User, phase: str, ticket_keys: List[str], now: datetime) -> None:
+        """Record one check of a user, now is in the configured time zone"""
+        now = now.replace(tzinfo=None)
+        with self.__lock:
+            previous = self.__last_seen.get(user.id)
+            if previous and previous[0] > now:
+                # a later check of the same user got here first
+                return
+            self.__last_seen[user.id] = (now, phase, list(ticket_keys))
+        if previous is None:
+            return
+        since, phase, ticket_keys = previous
+        seconds = int(min(self.__max_gap, (now - since).total_seconds()))
+        if not seconds or (not ticket_keys and phase != WORK):
+            return
+        shares = [(key, seconds // len(ticket_keys) + (1 if idx < seconds % len(ticket_keys) else 0))
+                  for (idx, key) in enumerate(ticket_keys)] if ticket_keys else [("", seconds)]
+        with db.atomic("IMMEDIATE"):
+            WorkSample.insert_many([{"user": user, "taken_at": since, "phase": phase, "ticket_key": key,
+                                     "seconds": share} for (key, share) in shares]).execute()
+            for (key, share) in shares:
+                for period in (HOUR, DAY):
+                    self.__add(user, period, period_start(since, period), phase, key, share)
+
+    @staticmethod
+    def __add(user: User, period: str, start: datetime, phase: str, ticket_key: str, seconds: int) -> None:
+        where = ((WorkRollup.user == user) & (WorkRollup.period == period) & (WorkRollup.start == start) &
+                 (WorkRollup.phase == phase) & (WorkRollup.ticket_key == ticket_key))
+        if WorkRollup.update(seconds=WorkRollup.seconds + seconds, samples=WorkRollup.samples + 1) \
+                .where(where).execute():
+            return
+        try:
+            with db.atomic():
+                WorkRollup.create(user=user, period=period, start=start, phase=phase, ticket_key=ticket_key,
+                                  seconds=seconds, samples=1)
+        except IntegrityError:
+            # another check of the same user created it first
+            WorkRollup.update(seconds=WorkRollup.seconds + seconds, samples=WorkRollup.samples + 1) \
+                .where(where).execute()
+
+
+def prune(now: datetime, sample_days: int, hourly_days: int) -> Tuple[int, int]:
+    """Delete samples and hourly rollups past their retention, returning how many of each were deleted
+
+    Daily rollups are kept forever.
+    """
+    now = now.replace(tzinfo=None)
+    samples = WorkSample.delete().where(WorkSample.taken_at < now - timedelta(days=sample_days)).execute()
+    hourly = WorkRollup.delete().where((WorkRollup.period == HOUR) &
+                                       (WorkRollup.start < now - timedelta(days=hourly_days))).execute()
+    return samples, hourly
+
+
+def _daily_totals(day: datetime, days: int, user: Optional[User] = None) -> list:
+    """Rollup rows summed per user, phase and ticket over the days up to and including the given one"""
+    start = period_start(day.replace(tzinfo=None), DAY)
+    query = WorkRollup.select(WorkRollup.user, WorkRollup.phase, WorkRollup.ticket_key,
+                              fn.SUM(WorkRollup.seconds).alias("total")) \
+        .where((WorkRollup.period == DAY) & (WorkRollup.start > start - timedelta(days=days)) &
+               (WorkRollup.start <= start))
+    if user:
+        query = query.where(WorkRollup.user == user)
+    return list(query.group_by(WorkRollup.user, WorkRollup.phase, WorkRollup.ticket_key).dicts())
+
+
+def _summarise(rows: list) -> Tuple[int, int, int]:
+    """Seconds with tickets in progress, with nothing in progress during work and with tickets in progress off hours"""
+    busy = sum(r["total"] for r in rows if r["ticket_key"])
+    idle = sum(r["total"] for r in rows if not r["ticket_key"] and r["phase"] == WORK)
+    after_hours = sum(r["total"] for r in rows if r["ticket_key"] and r["phase"] == OFF)
+    return busy, idle, after_hours
+
+
+def user_stats(user: User, now: datetime) -> str:
+    """Summary of a user's time today and over the last week"""
+    today = _daily_totals(now, 1, user)
+    busy, idle, after_hours = _summarise(today)
+    tickets = {}  # type: Dict[str, int]
+    for r in today:
+        if r["ticket_key"]:
+            tickets[r["ticket_key"]] = tickets.get(r["ticket_key"], 0) + r["total"]
+    week_busy, week_idle, week_after_hours = _summarise(_daily_totals(now, 7, user))
+    return "\n".join(["Today -- {0} in progress, {1} with nothing in progress, {2} in progress after hours"
+                      .format(format_duration(busy), format_duration(idle), format_duration(after_hours))] +
+                     ["{0} -- {1}".format(key, format_duration(seconds))
+                      for (key, seconds) in sorted(tickets.items(), key=lambda t: -t[1])] +
+                     ["Last 7 days -- {0} in progress, {1} with nothing in progress, {2} in progress after hours"
+                      .format(format_duration(week_busy), format_duration(week_idle),
+                              format_duration(week_after_hours))])
+
+
+def team_stats(now: datetime) -> str:
+    """Summary of every user's time today"""
+    by_user = {}  # type: Dict[int, list]
+    for r in _daily_totals(now, 1):
+        by_user.setdefault(r["user"], []).append(r)
+    names = {u.id: u.username for u in User.select(User.id, User.username).where(User.id << list(by_user))} \
+        if by_user else {}
+    lines = ["Team today:"]
+    for (user_id, rows) in sorted(by_user.items(), key=lambda u: names.get(u[0], "")):
+        busy, idle, after_hours = _summarise(rows)
+        lines.append("{0} -- {1} in progress, {2} idle, {3} after hours"
+                     .format(names.get(user_id, "?"), format_duration(busy), format_duration(idle),
+                             format_duration(after_hours)))
+    if len(lines) == 1:
+        lines.append("Nothing recorded yet.")
+    return "\n".join(lines)
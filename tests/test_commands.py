@@ -0,0 +1,51 @@
+import unittest
+
+from commands import build_routers, parse_hours, COMMANDS, CONTEXT_COMMANDS
+
+
+class CommandRouterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls = []
+        names = {name for (name, _) in COMMANDS} | {name for cmds in CONTEXT_COMMANDS.values() for (name, _) in cmds}
+        handlers = {name: (lambda session, match, name=name: self.calls.append((name, match))) for name in names}
+        self.handlers = handlers
+        self.routers = build_routers(handlers)
+
+    def dispatched(self, conflict_type, message):
+        self.calls = []
+        matched = self.routers[conflict_type].dispatch(None, message)
+        return self.calls[0][0] if matched else None
+
+    def test_alternatives_are_matched_whole(self) -> None:
+        self.assertEqual(self.dispatched("on_under", "no"), "dismiss")
+        self.assertEqual(self.dispatched("on_under", "resolve"), "dismiss")
+        self.assertEqual(self.dispatched("on_under", "yes"), "resume_prev")
+
+    def test_near_misses_are_rejected(self) -> None:
+        for message in ["nope", "not now", "no way, I am busy", "resolved", "yes please"]:
+            self.assertIsNone(self.dispatched("on_under", message), message)
+        self.assertIsNone(self.dispatched("on_over", "12 and 13"))
+        self.assertIsNone(self.dispatched(None, "show people please"))
+
+    def test_falls_back_to_common_commands(self) -> None:
+        self.assertEqual(self.dispatched("on_over", "3"), "choose_ticket")
+        self.assertEqual(self.dispatched("on_over", "help"), "help")
+        self.assertEqual(self.dispatched("off_over", "show team stats"), "show_team_stats")
+        self.assertIsNone(self.dispatched(None, "3"))
+
+    def test_set_hours(self) -> None:
+        self.assertEqual(self.dispatched(None, "set hours 9-5"), "set_hours")
+        start, end = parse_hours(self.calls[0][1])
+        self.assertEqual((start.hour, end.hour), (9, 17))
+
+    def test_handlers_must_match_commands(self) -> None:
+        handlers = {name: lambda session, match: None for name in self.handlers}
+        handlers["dismis"] = handlers.pop("dismiss")
+        with self.assertRaises(ValueError) as raised:
+            build_routers(handlers)
+        self.assertIn("'dismiss'", str(raised.exception))
+        self.assertIn("'dismis'", str(raised.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from db import db, User, WorkRollup, WorkSample
+from schedule import OFF, WORK
+from stats import DAY, WorkLog
+
+
+class WorkLogTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        db.init(os.path.join(self.dir, "stats.db"))
+        db.create_tables([User, WorkSample, WorkRollup])
+        self.user = User.create(username="alice")
+        self.log = WorkLog(1800)
+
+    def tearDown(self) -> None:
+        db.close()
+        shutil.rmtree(self.dir)
+
+    def totals(self):
+        return {(r.phase, r.ticket_key): r.seconds for r in WorkRollup.select().where(WorkRollup.period == DAY)}
+
+    def test_interval_is_credited_to_what_was_seen_at_its_start(self) -> None:
+        self.log.record(self.user, WORK, ["PROJ-1"], datetime(2024, 5, 6, 9, 0))
+        self.log.record(self.user, WORK, ["PROJ-2"], datetime(2024, 5, 6, 9, 15))
+        self.log.record(self.user, WORK, ["PROJ-2"], datetime(2024, 5, 6, 9, 30))
+        self.assertEqual(self.totals(), {(WORK, "PROJ-1"): 900, (WORK, "PROJ-2"): 900})
+
+    def test_end_of_day_is_credited_to_work(self) -> None:
+        self.log.record(self.user, WORK, ["PROJ-1"], datetime(2024, 5, 6, 16, 50))
+        self.log.record(self.user, OFF, ["PROJ-1"], datetime(2024, 5, 6, 17, 5))
+        self.assertEqual(self.totals(), {(WORK, "PROJ-1"): 900})
+
+    def test_gaps_are_capped(self) -> None:
+        self.log.record(self.user, WORK, [], datetime(2024, 5, 6, 9, 0))
+        self.log.record(self.user, WORK, [], datetime(2024, 5, 6, 12, 0))
+        self.assertEqual(self.totals(), {(WORK, ""): 1800})
+
+
+if __name__ == "__main__":
+    unittest.main()
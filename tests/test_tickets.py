@@ -0,0 +1,62 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from jira.exceptions import JIRAError
+from pytz import timezone
+
+from benchmarks.fakes import FakeJIRA
+import tickets
+from tickets import TicketCache
+
+
+class _Later(datetime):
+    """datetime whose now() is ten minutes ahead, as if a poll ran well after the change it should pick up"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.now(tz) + timedelta(minutes=10)
+
+
+class TicketCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.jira = FakeJIRA(timezone("UTC"))
+        self.jira.add_issue("PROJ-1", "alice", "In Progress")
+        self.jira.add_issue("PROJ-2", "bob", "In Progress")
+        self.cache = TicketCache(self.jira, "PROJ", 50, 3600, "UTC")
+        self.cache.refresh(["alice", "bob"])
+
+    def test_apply_moves_ticket_between_users(self) -> None:
+        self.assertEqual(self.cache.apply("PROJ-1", "In Progress", "bob"), {"alice", "bob"})
+        self.assertEqual(self.cache.get("alice"), [])
+        self.assertEqual(sorted(self.cache.get("bob")), ["PROJ-1", "PROJ-2"])
+        self.assertEqual(self.cache.apply("PROJ-1", None, None), {"bob"})
+        self.assertEqual(self.cache.get("bob"), ["PROJ-2"])
+
+    def test_apply_ignores_other_projects(self) -> None:
+        self.assertEqual(self.cache.apply("OTHER-9", "In Progress", "alice"), set())
+        self.assertEqual(self.cache.get("alice"), ["PROJ-1"])
+
+    def test_refresh_moves_ticket_reassigned_between_fetches(self) -> None:
+        # alice's tickets are fetched before PROJ-1 is reassigned and bob's after, with no poll in between
+        cache = TicketCache(self.jira, "PROJ", 50, 3600, "UTC", poll_interval=3600)
+        cache.refresh(["alice"])
+        self.jira.issues["PROJ-1"].fields.assignee.name = "bob"
+        cache.refresh(["alice", "bob"])
+        self.assertEqual(cache.get("alice"), [])
+        self.assertEqual(sorted(cache.get("bob")), ["PROJ-1", "PROJ-2"])
+        self.assertEqual(cache.apply("PROJ-1", None, None), {"bob"})
+
+    def test_failed_poll_is_searched_again(self) -> None:
+        self.jira.add_issue("PROJ-3", "alice", "Open")
+        self.jira.set_status("PROJ-3", "In Progress")
+        self.jira.error_rate = 1.0
+        with mock.patch.object(tickets, "datetime", _Later):
+            self.assertRaises(JIRAError, self.cache.refresh, ["alice", "bob"])
+        self.jira.error_rate = 0.0
+        self.assertEqual(self.cache.refresh(["alice", "bob"]), {"alice"})
+        self.assertEqual(sorted(self.cache.get("alice")), ["PROJ-1", "PROJ-3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from types import SimpleNamespace
+
+from jira.exceptions import JIRAError
+from pytz import timezone
+
+from benchmarks import fakes
+
+from jira_client import CircuitOpen
+from transitions import Transitioner
+
+
+def issue(key):
+    return SimpleNamespace(key=key, fields=SimpleNamespace(project=SimpleNamespace(key="PROJ"),
+                                                           issuetype=SimpleNamespace(id="1"),
+                                                           status=SimpleNamespace(id="3", name="In Progress")))
+
+
+class FakeJIRA(object):
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.lookups = 0
+        self.transitions = 0
+
+    def find_transitionid_by_name(self, issue, name):
+        self.lookups += 1
+        return str(self.lookups)
+
+    def transition_issue(self, key, transition_id):
+        self.transitions += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+class TransitionerTest(unittest.TestCase):
+    def transition(self, jira):
+        return Transitioner(jira, 3600, 1).transition([issue("PROJ-1")], "Halt Work")["PROJ-1"]
+
+    def test_rejected_id_is_looked_up_again(self) -> None:
+        jira = FakeJIRA(JIRAError(status_code=400, text="not valid for the current state"))
+        self.assertIsNone(self.transition(jira))
+        self.assertEqual((jira.lookups, jira.transitions), (2, 2))
+
+    def test_refusal_is_reported_without_retrying(self) -> None:
+        jira = FakeJIRA(JIRAError(status_code=403, text="not allowed"))
+        self.assertEqual(self.transition(jira), "not allowed")
+        self.assertEqual((jira.lookups, jira.transitions), (1, 1))
+
+    def test_other_errors_are_raised(self) -> None:
+        jira = FakeJIRA(CircuitOpen("JIRA is unavailable"))
+        self.assertRaises(CircuitOpen, self.transition, jira)
+        self.assertEqual(jira.transitions, 1)
+
+    def test_missing_keys_are_reported_per_ticket(self) -> None:
+        jira = fakes.FakeJIRA(timezone("UTC"))
+        jira.add_issue("PROJ-1", "alice", "In Progress")
+        results = Transitioner(jira, 3600, 1).transition_keys(["PROJ-1", "PROJ-404"], "Halt Work")
+        self.assertEqual(results, {"PROJ-1": None, "PROJ-404": "ticket not found"})
+        self.assertEqual(jira.issues["PROJ-1"].fields.status.name, "On Hold")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from webhook import parse_event
+
+
+def payload(key, status="In Progress", assignee="alice", project=None, event="jira:issue_updated"):
+    fields = {"status": {"name": status}, "assignee": {"name": assignee} if assignee else None}
+    if project:
+        fields["project"] = {"key": project}
+    return {"webhookEvent": event, "issue": {"key": key, "fields": fields}}
+
+
+class ParseEventTest(unittest.TestCase):
+    def test_issue_event(self) -> None:
+        self.assertEqual(parse_event(payload("PROJ-1")), ("PROJ-1", "In Progress", "alice"))
+        self.assertEqual(parse_event(payload("PROJ-1", event="jira:issue_deleted")), ("PROJ-1", None, "alice"))
+        self.assertIsNone(parse_event({"webhookEvent": "jira:worklog_updated"}))
+
+    def test_other_projects_are_dropped(self) -> None:
+        self.assertEqual(parse_event(payload("PROJ-1"), "PROJ"), ("PROJ-1", "In Progress", "alice"))
+        self.assertIsNone(parse_event(payload("OTHER-9"), "PROJ"))
+        self.assertIsNone(parse_event(payload("PROJ-9", project="OTHER"), "PROJ"))
+        self.assertEqual(parse_event(payload("OTHER-9", project="PROJ"), "PROJ")[0], "OTHER-9")
+        # PROJX is not PROJ
+        self.assertIsNone(parse_event(payload("PROJX-1"), "PROJ"))
+
+
+if __name__ == "__main__":
+    unittest.main()
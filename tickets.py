@@ -0,0 +1,185 @@
+from jira import JIRA
+from datetime import datetime, timedelta
+from threading import Lock
+from pytz import timezone
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# issues asked for per search request, JIRA may return fewer
+PAGE_SIZE = 100
+
+
+def in_progress_query(project: str, usernames: Iterable[str]) -> str:
+    """Build the JQL for every 'In Progress' ticket assigned to any of the given users"""
+    return "project={0} and assignee in ({1}) and status=\"In Progress\"" \
+        .format(project, ",".join("\"{0}\"".format(u) for u in usernames))
+
+
+def chunked(items: List[str], size: int) -> List[List[str]]:
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class SearchResults(object):
+    """Issues matching a JQL search, fetched a page at a time as they are iterated over
+
+    Only the given comma separated fields are requested.  The first page is fetched straight away so total is known
+    without loading the rest, later pages are only fetched once iteration reaches them.  Without validate JIRA skips
+    parts of the query it cannot resolve, e.g. keys of deleted tickets, instead of rejecting the whole search.
+    """
+
+    def __init__(self, jira_conn: JIRA, jql: str, fields: str, page_size: int = PAGE_SIZE,
+                 validate: bool = True) -> None:
+        self.__jira = jira_conn
+        self.__jql = jql
+        self.__fields = fields
+        self.__page_size = page_size
+        self.__validate = validate
+        self.__first = self.__page(0)
+        self.total = self.__first.total  # type: int
+
+    def __page(self, start: int) -> list:
+        return self.__jira.search_issues(self.__jql, startAt=start, maxResults=self.__page_size, fields=self.__fields,
+                                         validate_query=self.__validate)
+
+    def __iter__(self) -> Iterator:
+        page = self.__first
+        start = 0
+        while page:
+            yield from page
+            start += len(page)
+            if start >= page.total:
+                return
+            page = self.__page(start)
+
+
+def search(jira_conn: JIRA, jql: str, fields: str, validate: bool = True) -> SearchResults:
+    """Search for issues, requesting only the given fields and streaming the results page by page"""
+    return SearchResults(jira_conn, jql, fields, validate=validate)
+
+
+def fetch_in_progress(jira_conn: JIRA, project: str, usernames: List[str]) -> Dict[str, List[str]]:
+    """Fetch 'In Progress' ticket keys for a group of users with a single streamed search
+
+    Every requested user is present in the result, users with nothing in progress map to an empty list.  Keys are
+    lower cased usernames since JQL matches assignees case insensitively.
+    """
+    grouped = {u.lower(): [] for u in usernames}  # type: Dict[str, List[str]]
+    if not usernames:
+        return grouped
+    for t in search(jira_conn, in_progress_query(project, usernames), "assignee"):
+        if t.fields.assignee and t.fields.assignee.name.lower() in grouped:
+            grouped[t.fields.assignee.name.lower()].append(t.key)
+    return grouped
+
+
+class TicketCache(object):
+    """Local copy of every tracked user's 'In Progress' tickets
+
+    Between full resyncs the cache is kept current with a single search for tickets updated since the last refresh,
+    so the cost of a refresh follows the number of changed tickets rather than the number of users.  When changes are
+    pushed in through apply, poll_interval can be raised so that search only runs as an occasional reconciliation.
+    """
+
+    # JQL dates only go down to the minute, so each delta search overlaps the previous one a little
+    OVERLAP = timedelta(minutes=2)
+
+    def __init__(self, jira_conn: JIRA, project: str, chunk_size: int, resync_interval: float, tz: str,
+                 poll_interval: float = 0.0) -> None:
+        self.__jira = jira_conn
+        self.__project = project
+        self.__chunk_size = chunk_size
+        self.__resync_interval = resync_interval
+        self.__poll_interval = poll_interval
+        self.__tz = timezone(tz)
+        self.__lock = Lock()
+        self.__tickets = {}  # type: Dict[str, List[str]]
+        self.__owners = {}  # type: Dict[str, str]
+        self.__watermark = None  # type: datetime
+        self.__last_resync = 0.0
+        self.__last_poll = 0.0
+
+    def get(self, username: str) -> List[str]:
+        """Cached 'In Progress' ticket keys for a user"""
+        with self.__lock:
+            return list(self.__tickets.get(username.lower(), []))
+
+    def refresh(self, usernames: List[str]) -> Set[str]:
+        """Bring the cache up to date for the given users and return the users whose tickets changed"""
+        tracked = {u.lower() for u in usernames}
+        with self.__lock:
+            for u in set(self.__tickets) - tracked:
+                self.__untrack(u)
+            resync = time.time() - self.__last_resync >= self.__resync_interval
+            if resync:
+                self.__tickets = {}
+                self.__owners = {}
+                self.__last_resync = time.time()
+            missing = [u for u in usernames if u.lower() not in self.__tickets]
+            since = self.__watermark
+            poll = not resync and since and time.time() - self.__last_poll >= self.__poll_interval
+            # taken before searching, but only moved on once the searches succeeded so a failed poll is retried
+            watermark = datetime.now(self.__tz)
+            polled_at = time.time()
+
+            changed = set()  # type: Set[str]
+            for chunk in chunked(missing, self.__chunk_size):
+                for u, keys in fetch_in_progress(self.__jira, self.__project, chunk).items():
+                    self.__tickets[u] = []
+                    for key in keys:
+                        self.__track(key, u)
+                    changed.add(u)
+
+            if poll:
+                changed |= self.__apply_updates(since)
+            if resync or poll:
+                self.__watermark = watermark
+                self.__last_poll = polled_at
+            return changed
+
+    def apply(self, key: str, status: Optional[str], assignee: Optional[str]) -> Set[str]:
+        """Apply one ticket's new status and assignee, returning the users affected
+
+        A status of None means the ticket no longer exists.  Tickets outside the cache's project are ignored.
+        """
+        if key.rsplit("-", 1)[0] != self.__project:
+            return set()
+        with self.__lock:
+            return self.__apply(key, status, assignee)
+
+    def __apply_updates(self, since: datetime) -> Set[str]:
+        """Apply every ticket updated since the given time, returning the users affected"""
+        changed = set()  # type: Set[str]
+        jql = "project={0} and updated >= \"{1}\"".format(self.__project,
+                                                          (since - self.OVERLAP).strftime("%Y/%m/%d %H:%M"))
+        for t in search(self.__jira, jql, "assignee,status"):
+            changed |= self.__apply(t.key, t.fields.status.name,
+                                    t.fields.assignee.name if t.fields.assignee else None)
+        return changed
+
+    def __apply(self, key: str, status: Optional[str], assignee: Optional[str]) -> Set[str]:
+        changed = set()  # type: Set[str]
+        owner = assignee.lower() if assignee and status == "In Progress" else None
+        if owner not in self.__tickets:
+            owner = None
+        if self.__owners.get(key) == owner:
+            return changed
+        if key in self.__owners:
+            changed.add(self.__owners[key])
+            self.__tickets[self.__owners.pop(key)].remove(key)
+        if owner:
+            self.__track(key, owner)
+            changed.add(owner)
+        return changed
+
+    def __track(self, key: str, username: str) -> None:
+        previous = self.__owners.get(key)
+        if previous is not None and previous != username:
+            # reassigned since the previous owner's tickets were fetched
+            self.__tickets[previous].remove(key)
+        self.__tickets[username].append(key)
+        self.__owners[key] = username
+
+    def __untrack(self, username: str) -> None:
+        for key in self.__tickets.pop(username):
+            del self.__owners[key]
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from jira import JIRA
+from jira.exceptions import JIRAError
+from jira.resources import Issue
+from threading import Lock
+from tickets import search
+import time
+from typing import Dict, List, Optional, Tuple
+
+# fields a ticket needs for its transition to be looked up in the cache
+TRANSITION_FIELDS = "project,issuetype,status"
+
+
+class TransitionCache(object):
+    """Transition ids keyed by workflow, issue type and status
+
+    JIRA picks a ticket's workflow from its project and issue type, so together with the current status those decide
+    which transitions are available.  Entries expire after ttl seconds so workflow edits are eventually picked up.
+    """
+
+    def __init__(self, jira_conn: JIRA, ttl: float) -> None:
+        self.__jira = jira_conn
+        self.__ttl = ttl
+        self.__lock = Lock()
+        self.__ids = {}  # type: Dict[Tuple[str, str, str, str], Tuple[Optional[str], float]]
+
+    @staticmethod
+    def __key(issue: Issue, name: str) -> Tuple[str, str, str, str]:
+        return issue.fields.project.key, issue.fields.issuetype.id, issue.fields.status.id, name
+
+    def lookup(self, issue: Issue, name: str) -> Optional[str]:
+        """Id of the named transition for a ticket, None if it is not available from the ticket's status"""
+        key = self.__key(issue, name)
+        with self.__lock:
+            cached = self.__ids.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+        transition_id = self.__jira.find_transitionid_by_name(issue, name)
+        with self.__lock:
+            self.__ids[key] = (transition_id, time.time() + self.__ttl)
+        return transition_id
+
+    def invalidate(self, issue: Issue, name: str) -> None:
+        """Forget a cached transition id, e.g. after JIRA rejected it"""
+        with self.__lock:
+            self.__ids.pop(self.__key(issue, name), None)
+
+
+class Transitioner(object):
+    """Apply one workflow transition to many tickets at once"""
+
+    def __init__(self, jira_conn: JIRA, ttl: float, max_workers: int) -> None:
+        self.__jira = jira_conn
+        self.__cache = TransitionCache(jira_conn, ttl)
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def transition_keys(self, keys: List[str], name: str) -> Dict[str, Optional[str]]:
+        """Transition tickets by key, fetching all of them with one search first"""
+        results = OrderedDict((k, "ticket not found") for k in keys)  # type: Dict[str, Optional[str]]
+        if keys:
+            # unvalidated so a deleted ticket is left out of the results instead of failing the whole search
+            issues = search(self.__jira, "key in ({0})".format(",".join(keys)), TRANSITION_FIELDS, validate=False)
+            results.update(self.transition(list(issues), name))
+        return results
+
+    def transition(self, issues: List[Issue], name: str) -> Dict[str, Optional[str]]:
+        """Transition tickets concurrently
+
+        Tickets must have been fetched with at least TRANSITION_FIELDS.  Returns each ticket's key mapped to None on
+        success or to a description of why JIRA refused it, other errors such as CircuitOpen are raised.
+        """
+        return OrderedDict(zip([i.key for i in issues],
+                               self.__pool.map(lambda i: self.__transition_one(i, name), issues)))
+
+    def __transition_one(self, issue: Issue, name: str) -> Optional[str]:
+        for attempt in range(2):
+            transition_id = self.__cache.lookup(issue, name)
+            if not transition_id:
+                return "'{0}' is not available from '{1}'".format(name, issue.fields.status.name)
+            try:
+                self.__jira.transition_issue(issue.key, transition_id)
+                return None
+            except JIRAError as e:
+                if e.status_code != 400 or attempt:
+                    return e.text or str(e)
+                # JIRA rejected the id, the cached one may be stale so look it up again once
+                self.__cache.invalidate(issue, name)
+
+
+def describe_failures(results: Dict[str, Optional[str]], status: str) -> List[str]:
+    """One line per ticket that could not be moved to the given status"""
+    return ["Could not set {0} to '{1}': {2}".format(k, status, err) for (k, err) in results.items() if err]
@@ -0,0 +1,118 @@
+"""Receive JIRA issue webhooks
+
+Point a JIRA webhook for issue created, updated and deleted events at http://<host>:<webhook_port>/?secret=<secret>.
+Running this module sends a fake webhook instead, e.g. to try the listener out locally:
+
+    python webhook.py http://localhost:8080/?secret=s3cret PROJ-123 "In Progress" someuser
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+import json
+import logging
+import sys
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# (ticket key, status name or None if the ticket was deleted, assignee username or None) -> None
+IssueCallback = Callable[[str, Optional[str], Optional[str]], None]
+
+
+def parse_event(payload: dict, project: Optional[str] = None) -> Optional[tuple]:
+    """(key, status, assignee) from a JIRA webhook payload
+
+    None if it is not about an issue, or about an issue outside project when one is given.
+    """
+    if not payload.get("webhookEvent", "").startswith("jira:issue_") or "issue" not in payload:
+        return None
+    fields = payload["issue"].get("fields") or {}
+    if project and ((fields.get("project") or {}).get("key") or payload["issue"]["key"].rsplit("-", 1)[0]) != project:
+        return None
+    status = (fields.get("status") or {}).get("name")
+    assignee = (fields.get("assignee") or {}).get("name")
+    if payload["webhookEvent"] == "jira:issue_deleted":
+        status = None
+    return payload["issue"]["key"], status, assignee
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookListener(object):
+    """Embedded HTTP server handing every issue webhook it receives to a callback
+
+    When project is given, webhooks about issues in other projects are acknowledged and dropped.
+    """
+
+    def __init__(self, host: str, port: int, secret: Optional[str], on_issue: IssueCallback,
+                 project: Optional[str] = None) -> None:
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                listener.handle(self)
+
+            def log_message(self, fmt: str, *args) -> None:
+                logger.debug(fmt, *args)
+
+        self.__secret = secret
+        self.__on_issue = on_issue
+        self.__project = project
+        self.__server = _ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def port(self) -> int:
+        return self.__server.server_address[1]
+
+    def start(self) -> None:
+        """Start serving on a background thread"""
+        t = Thread(target=self.__server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+
+    def handle(self, request: BaseHTTPRequestHandler) -> None:
+        """Answer one webhook POST"""
+        if self.__secret and parse_qs(urlparse(request.path).query).get("secret") != [self.__secret]:
+            request.send_response(403)
+            request.end_headers()
+            return
+        try:
+            body = request.rfile.read(int(request.headers.get("Content-Length", 0)))
+            event = parse_event(json.loads(body.decode("utf-8")), self.__project)
+        except (ValueError, KeyError, AttributeError):
+            request.send_response(400)
+            request.end_headers()
+            return
+        # JIRA does not care what happens next, so answer before doing anything slow
+        request.send_response(204)
+        request.end_headers()
+        if event:
+            try:
+                self.__on_issue(*event)
+            except Exception:
+                logger.exception("Failed to apply webhook for %s", event[0])
+
+
+def send_issue_event(url: str, key: str, status: Optional[str], assignee: Optional[str],
+                     event: str = "jira:issue_updated") -> int:
+    """POST a minimal JIRA issue webhook, returning the response status"""
+    payload = {"webhookEvent": event,
+               "issue": {"key": key, "fields": {"status": {"name": status} if status else None,
+                                                "assignee": {"name": assignee} if assignee else None}}}
+    req = Request(url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+    with urlopen(req) as resp:
+        return resp.status
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5):
+        print(__doc__)
+        sys.exit(1)
+    print(send_issue_event(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) == 5 else None))